@@ -0,0 +1,55 @@
+''' Load test of /predict/batch against one /predict/{region} call per region, on a local model registry
+
+Usage: python benchmarks/bench_api_batch.py [--regions Albany Atlanta ...] [--rounds 50] [--rows 4]
+'''
+import argparse
+import time
+
+import numpy as np
+
+import common
+import configs
+import local_registry
+
+
+def latency_summary(latencies, n_requests):
+    latencies = np.asarray(latencies)
+    return (f'{n_requests / latencies.sum():8.1f} req/s | '
+            f'p50 {np.percentile(latencies, 50) * 1000:7.2f}ms | p99 {np.percentile(latencies, 99) * 1000:7.2f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', nargs='+', default=configs.configs['target_regions'])
+    parser.add_argument('--rounds', type=int, default=50, help='Dashboard refreshes (one forecast per region) to run')
+    parser.add_argument('--rows', type=int, default=4, help='Records per region')
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=args.regions)
+    records = local_registry.sample_records(args.regions, args.rows)
+
+    with local_registry.api_client(uri) as client:
+        single_latencies, refresh_single, refresh_batch = [], [], []
+        for _ in range(args.rounds):
+            refresh_start = time.perf_counter()
+            for region, region_records in records.items():
+                start = time.perf_counter()
+                response = client.post(f'/predict/{region}', json=region_records)
+                single_latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+            refresh_single.append(time.perf_counter() - refresh_start)
+
+            start = time.perf_counter()
+            response = client.post('/predict/batch', json=records)
+            refresh_batch.append(time.perf_counter() - start)
+            response.raise_for_status()
+
+    print(f'{len(records)} regions x {args.rows} rows, {args.rounds} rounds')
+    print(f'/predict/{{region}} per request:  {latency_summary(single_latencies, len(single_latencies))}')
+    print(f'/predict/{{region}} per refresh:  {latency_summary(refresh_single, len(refresh_single))}')
+    print(f'/predict/batch per refresh:     {latency_summary(refresh_batch, len(refresh_batch))}')
+    print(f'Refresh speed-up: {np.mean(refresh_single) / np.mean(refresh_batch):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+''' Latency of /predict/{region} with the prediction cache: the first request of a payload against its repeats
+
+Each round posts a fresh payload (a miss, predicted by the model) then repeats it (a hit). The cache lookup itself
+is timed on the validated rows, apart from the request handling around it.
+
+Usage: python benchmarks/bench_api_cache.py [--region Albany] [--rounds 200] [--rows 1 10 100]
+'''
+import argparse
+import time
+
+import numpy as np
+
+import common
+import local_registry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', default='Albany')
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--serving-mode', default='pyfunc')
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=[args.region])
+    history = local_registry.sample_records([args.region], n_rows=1000)[args.region]
+
+    with local_registry.api_client(uri, SERVING_MODE=args.serving_mode, PREDICTION_CACHE_SIZE='100000') as client:
+        from src import api
+
+        for n_rows in args.rows:
+            miss_latencies, hit_latencies = [], []
+            for i in range(args.rounds):
+                # A different window of the history each round, so the first post is a miss
+                records = [history[(i + j) % len(history)] for j in range(n_rows)]
+                for latencies in [miss_latencies, hit_latencies]:
+                    start = time.perf_counter()
+                    response = client.post(f'/predict/{args.region}', json=records)
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+            api.prediction_cache.entries.clear()
+
+            model_entry = api.get_model_entry(args.region, api.all_region_models)
+            rows = model_entry['validator'].validate(records)
+            key = api.prediction_cache.key(args.region, model_entry, rows)
+            api.prediction_cache.put(key, np.zeros(n_rows))
+            lookup_seconds, _ = common.time_call(
+                lambda: api.prediction_cache.get(api.prediction_cache.key(args.region, model_entry, rows)),
+                repeat=1000)
+
+            print(f'{n_rows:>4} rows | miss p50 {np.percentile(miss_latencies, 50) * 1000:7.2f}ms '
+                  f'| hit p50 {np.percentile(hit_latencies, 50) * 1000:7.2f}ms '
+                  f'| speed-up {np.median(miss_latencies) / np.median(hit_latencies):5.1f}x '
+                  f'| key + lookup {lookup_seconds * 1e6:6.1f}us')
+        print(api.prediction_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+''' Latency of /predict/{region} with SERVING_MODE=pyfunc against SERVING_MODE=native, at several rows per request
+
+Usage: python benchmarks/bench_api_fast_path.py [--region Albany] [--rows 1 10 1000] [--requests 200]
+'''
+import argparse
+import time
+
+import numpy as np
+
+import common
+import local_registry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', default='Albany')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 1000])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=[args.region])
+    history = local_registry.sample_records([args.region], n_rows=1000)[args.region]
+    payloads = {n_rows: (history * (n_rows // len(history) + 1))[:n_rows] for n_rows in args.rows}
+
+    results = {}
+    for mode in ['pyfunc', 'native']:
+        with local_registry.api_client(uri, SERVING_MODE=mode) as client:
+            for n_rows, payload in payloads.items():
+                latencies = []
+                for _ in range(args.requests):
+                    start = time.perf_counter()
+                    response = client.post(f'/predict/{args.region}', json=payload)
+                    latencies.append(time.perf_counter() - start)
+                    response.raise_for_status()
+                results[mode, n_rows] = (np.asarray(latencies) * 1000, response.json()['prediction'])
+
+    for n_rows in args.rows:
+        pyfunc_ms, pyfunc_pred = results['pyfunc', n_rows]
+        native_ms, native_pred = results['native', n_rows]
+        np.testing.assert_allclose(pyfunc_pred, native_pred, rtol=1e-6)
+        print(f'{n_rows:>5} rows | pyfunc p50 {np.median(pyfunc_ms):7.2f}ms p99 {np.percentile(pyfunc_ms, 99):7.2f}ms '
+              f'| native p50 {np.median(native_ms):7.2f}ms p99 {np.percentile(native_ms, 99):7.2f}ms '
+              f'| speed-up {np.median(pyfunc_ms) / np.median(native_ms):5.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+''' Overhead of the Prometheus instrumentation on /predict/{region}: latency with METRICS_ENABLED on and off
+
+Rounds of requests alternate between the two settings on the same app, so drift affects both equally.
+
+Usage: python benchmarks/bench_api_metrics.py [--region Albany] [--rows 1 100] [--requests 500] [--rounds 5]
+'''
+import argparse
+import time
+
+import numpy as np
+
+import common
+import local_registry
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', default='Albany')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--serving-mode', default='native')
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=[args.region])
+    history = local_registry.sample_records([args.region], n_rows=1000)[args.region]
+
+    with local_registry.api_client(uri, SERVING_MODE=args.serving_mode) as client:
+        from src import metrics
+
+        for n_rows in args.rows:
+            payload = (history * (n_rows // len(history) + 1))[:n_rows]
+            latencies = {True: [], False: []}
+            for _ in range(args.rounds):
+                for enabled in [True, False]:
+                    metrics.enabled = enabled
+                    for _ in range(args.requests):
+                        start = time.perf_counter()
+                        client.post(f'/predict/{args.region}', json=payload).raise_for_status()
+                        latencies[enabled].append(time.perf_counter() - start)
+            metrics.enabled = True
+            on_us, off_us = np.median(latencies[True]) * 1e6, np.median(latencies[False]) * 1e6
+            print(f'{n_rows:>5} rows | metrics off p50 {off_us:8.1f}us | on p50 {on_us:8.1f}us '
+                  f'| overhead {on_us - off_us:6.1f}us ({(on_us - off_us) / off_us:+.1%})')
+
+        start = time.perf_counter()
+        for _ in range(100):
+            client.get('/metrics').raise_for_status()
+        print(f'GET /metrics: {(time.perf_counter() - start) / 100 * 1000:.2f}ms per scrape')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+''' Throughput of request validation: the per record pydantic schema against the compiled column-wise validator
+
+Both produce the float32 array the native booster predicts on. The pydantic path is what validate_records did
+before: the schema instantiated and dumped for every record, then the records copied into the array. The schema
+fallback line sends numbers as strings, which the validator hands to the schema.
+
+Usage: python benchmarks/bench_api_validation.py [--region Albany] [--rows 1 10 100 1000 10000]
+'''
+import argparse
+import os
+from operator import itemgetter
+
+import numpy as np
+
+import common
+import local_registry
+
+
+def validate_with_schema(schema, feature_names, records):
+    validated = [schema(**record).model_dump() for record in records]
+    get_features = itemgetter(*feature_names)
+    model_input = np.empty((len(validated), len(feature_names)), dtype=np.float32)
+    for i, record in enumerate(validated):
+        model_input[i] = get_features(record)
+    return model_input
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--region', default='Albany')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=[args.region])
+    history = local_registry.sample_records([args.region], n_rows=1000)[args.region]
+
+    import mlflow
+    from src import api
+
+    mlflow.set_tracking_uri(uri)
+    os.environ['SERVING_MODE'] = 'native'
+    model_info = api.list_registered_models(mlflow.MlflowClient())[args.region]
+    model_entry = api.load_model_entry(model_info)
+    schema, feature_names, validator = model_entry['input_schema'], model_entry['feature_names'], model_entry['validator']
+
+    for n_rows in args.rows:
+        records = (history * (n_rows // len(history) + 1))[:n_rows]
+        repeat = max(3, 20000 // n_rows)
+        schema_seconds, expected = common.time_call(
+            validate_with_schema, schema, feature_names, records, repeat=repeat)
+        validator_seconds, model_input = common.time_call(validator.validate, records, repeat=repeat)
+        np.testing.assert_array_equal(model_input, expected)
+        print(f'{n_rows:>6} rows | pydantic {n_rows / schema_seconds:>10,.0f} rows/s '
+              f'| column-wise {n_rows / validator_seconds:>12,.0f} rows/s '
+              f'| speed-up {schema_seconds / validator_seconds:6.1f}x')
+
+    # Numbers sent as strings are valid but leave the fast path: the cost of falling back to the schema
+    n_rows = max(args.rows)
+    records = (history * (n_rows // len(history) + 1))[:n_rows]
+    records = [{name: str(value) for name, value in record.items()} for record in records]
+    schema_seconds, _ = common.time_call(validate_with_schema, schema, feature_names, records, repeat=3)
+    validator_seconds, _ = common.time_call(validator.validate, records, repeat=3)
+    print(f'{n_rows:>6} rows as strings (schema fallback) | pydantic {n_rows / schema_seconds:>10,.0f} rows/s '
+          f'| column-wise {n_rows / validator_seconds:>10,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
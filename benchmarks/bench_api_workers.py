@@ -0,0 +1,98 @@
+''' Memory and startup time of the multi-worker API by worker count: uvicorn workers against gunicorn pre-fork
+
+uvicorn --workers starts each worker as a new process that imports the app and loads its own copy of every model.
+gunicorn with src/gunicorn_conf.py loads the models once in the master and forks the workers from it. Both use
+a fresh MODEL_CACHE_DIR, and the downloads column counts how many model downloads reached the registry.
+
+Startup is the time until every worker has answered /models. Memory is read from /proc through psutil:
+RSS counts shared pages in every process that maps them, USS is the memory only that process holds, and the
+PSS total (shared pages split between the processes sharing them, master included) is what the server costs.
+
+Usage: python benchmarks/bench_api_workers.py [--workers 1 2 4] [--regions Albany Atlanta ...]
+'''
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+import psutil
+
+import common
+import local_registry
+from load_test import free_port
+
+MB = 1024 ** 2
+
+
+def server_command(mode, port, n_workers):
+    if mode == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'src.api:app', '--port', str(port), '--workers', str(n_workers),
+                '--log-level', 'warning']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'src/gunicorn_conf.py', 'src.api:app', '--log-level', 'warning']
+
+
+def measure_server(mode, uri, n_workers, records):
+    ''' Startup seconds, memory per process and model downloads of a server with n_workers workers '''
+    port = free_port()
+    with tempfile.TemporaryDirectory() as cache_dir, tempfile.TemporaryFile('w+') as log:
+        env = {**os.environ, 'MLFLOW_TRACKING_URI': uri, 'MODEL_CACHE_DIR': cache_dir,
+               'API_WORKERS': str(n_workers), 'API_PORT': str(port)}
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            server_command(mode, port, n_workers), cwd=common.REPO_DIR, env=env, stdout=log, stderr=subprocess.DEVNULL)
+        url = f'http://127.0.0.1:{port}'
+        try:
+            # A new connection per request, so the requests spread over the workers
+            pids, deadline = set(), time.monotonic() + 300
+            while len(pids) < n_workers:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'{mode} server with {n_workers} workers did not start')
+                try:
+                    pids.add(httpx.get(f'{url}/models').json()['pid'])
+                except httpx.HTTPError:
+                    time.sleep(0.05)
+            startup_seconds = time.perf_counter() - start
+
+            for region, region_records in records.items():
+                httpx.post(f'{url}/predict/{region}', json=region_records).raise_for_status()
+            master = psutil.Process(process.pid)
+            workers = [psutil.Process(pid) for pid in pids]
+            worker_memory = [worker.memory_full_info() for worker in workers]
+            total_pss = sum(p.memory_full_info().pss for p in [master, *master.children(recursive=True)])
+        finally:
+            process.terminate()
+            process.wait()
+        log.seek(0)
+        downloads = log.read().count('Downloaded model')
+    return {
+        'startup_seconds': startup_seconds,
+        'rss_per_worker': sum(memory.rss for memory in worker_memory) / len(worker_memory),
+        'uss_per_worker': sum(memory.uss for memory in worker_memory) / len(worker_memory),
+        'total_pss': total_pss,
+        'downloads': downloads,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--regions', nargs='+', default=['Albany', 'Atlanta', 'Boise', 'SanDiego', 'SanFrancisco'])
+    parser.add_argument('--modes', nargs='+', default=['uvicorn', 'gunicorn'])
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=args.regions)
+    records = local_registry.sample_records(args.regions, n_rows=1)
+    print(f'{len(args.regions)} models')
+    for mode in args.modes:
+        for n_workers in args.workers:
+            result = measure_server(mode, uri, n_workers, records)
+            print(f'{mode:<8} | {n_workers:>2} workers | startup {result["startup_seconds"]:6.2f}s '
+                  f'| RSS/worker {result["rss_per_worker"] / MB:6.1f}MB | USS/worker {result["uss_per_worker"] / MB:6.1f}MB '
+                  f'| PSS total {result["total_pss"] / MB:7.1f}MB | {result["downloads"]} downloads')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+''' Cold start cost of the training script and the API: import time in fresh interpreters
+
+Each line imports one entry point in a new process, --repeat times, and reports the best wall time. The
+"eager" statements also import what the module used to import at the top (matplotlib with its default backend,
+MLflow, XGBoost, scikit-learn and Optuna for train_models, MLflow for the API), which is what starting it cost
+before, less kagglehub, which is no longer a dependency. The last lines are what a training job imports before
+its first fit, with and without plots. The heaviest direct imports of each entry point come from
+python -X importtime.
+
+Usage: python benchmarks/bench_import_time.py [--repeat 5] [--top 5]
+'''
+import argparse
+import subprocess
+import sys
+
+import common
+
+TRAIN_MODELS_EAGER = (
+    'import matplotlib.pyplot, mlflow.xgboost, xgboost, sklearn.metrics, sklearn.model_selection, '
+    'optuna, tuning, tracking, ingestion, train_models')
+
+ENTRY_POINTS = [
+    ('train_models', common.MODELLING_DIR, 'import train_models', TRAIN_MODELS_EAGER),
+    ('src.api', common.REPO_DIR, 'import src.api', 'import mlflow.xgboost, mlflow.models, src.api'),
+    ('training job, log_plots=False', common.MODELLING_DIR,
+     'import train_models, mlflow, tracking, xgboost, sklearn.metrics', TRAIN_MODELS_EAGER),
+    ('training job, log_plots=True', common.MODELLING_DIR,
+     'import train_models, mlflow, tracking, xgboost, sklearn.metrics; train_models.pyplot()', TRAIN_MODELS_EAGER),
+]
+
+
+def import_seconds(cwd, statement):
+    code = f'import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)'
+    output = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(cwd, statement, top):
+    ''' (cumulative seconds, module) of the direct imports of a statement, heaviest first '''
+    output = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', statement], cwd=cwd, capture_output=True, text=True, check=True)
+    entries = {}
+    for line in output.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # -X importtime indents nested imports by two spaces per level, the entry point is at level 0
+        if len(name) - len(name.lstrip()) == 3:
+            module = name.strip()
+            entries[module] = entries.get(module, 0) + int(cumulative) / 1e6
+    return sorted(((seconds, module) for module, seconds in entries.items()), reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5)
+    args = parser.parse_args()
+
+    for name, cwd, statement, eager_statement in ENTRY_POINTS:
+        lazy_seconds = min(import_seconds(cwd, statement) for _ in range(args.repeat))
+        eager_seconds = min(import_seconds(cwd, eager_statement) for _ in range(args.repeat))
+        print(f'{name:<32} | now {lazy_seconds:6.2f}s | eager {eager_seconds:6.2f}s '
+              f'| saved {eager_seconds - lazy_seconds:6.2f}s')
+
+    for name, cwd, statement, _ in ENTRY_POINTS[:2]:
+        heaviest = ', '.join(f'{module} {seconds:.2f}s' for seconds, module in heaviest_imports(cwd, statement, args.top))
+        print(f'{name} heaviest imports: {heaviest}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+''' Training wall time with MLflow round trips made slow, uploading each region before the next one starts
+(blocking) against uploading in the background while the next regions train (deferred)
+
+Every tracking and registry store call of the local file store sleeps --latency-ms, standing in for the HTTP
+round trip to a remote tracking server, and the calls are counted.
+
+Usage: python benchmarks/bench_mlflow_logging.py [--regions Albany Atlanta] [--latency-ms 50]
+'''
+import argparse
+import collections
+import contextlib
+import functools
+import io
+import tempfile
+import time
+
+import common
+import local_registry
+
+
+@contextlib.contextmanager
+def slow_stores(latency):
+    ''' Add `latency` seconds to every public method of the file tracking and registry stores, counting calls '''
+    from mlflow.store.model_registry.file_store import FileStore as FileRegistryStore
+    from mlflow.store.tracking.file_store import FileStore
+
+    calls = collections.Counter()
+    originals = []
+    for store in [FileStore, FileRegistryStore]:
+        for name, method in list(vars(store).items()):
+            if name.startswith('_') or not callable(method):
+                continue
+
+            def slow_method(*args, __method=method, __name=name, **kwargs):
+                calls[__name] += 1
+                time.sleep(latency)
+                return __method(*args, **kwargs)
+
+            originals.append((store, name, method))
+            setattr(store, name, functools.wraps(method)(slow_method))
+    try:
+        yield calls
+    finally:
+        for store, name, method in originals:
+            setattr(store, name, method)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', nargs='+', default=None)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    args = parser.parse_args()
+
+    import feature_store
+    import mlflow
+    import train_models
+
+    bench_configs = local_registry.benchmark_configs(args.regions)
+    _, region_data = feature_store.get_features(bench_configs, data_path=common.DATA_PATH)
+
+    for mode in ['blocking', 'deferred']:
+        mlflow.set_tracking_uri(local_registry.tracking_uri(tempfile.mkdtemp(prefix=f'bench_logging_{mode}_')))
+        experiment = mlflow.set_experiment('bench_logging')
+        with slow_stores(args.latency_ms / 1000) as calls, contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            if mode == 'blocking':
+                # A private logger per region is waited on before the next region trains
+                for region, (X, y, dates) in region_data.items():
+                    train_models.train_region(region, X, y, dates, bench_configs, experiment.experiment_id)
+            else:
+                _, failures = train_models.train_all_regions(region_data, bench_configs, experiment.experiment_id)
+                assert not failures, failures
+            seconds = time.perf_counter() - start
+        print(f'{mode:>9} | {len(region_data)} regions in {seconds:7.2f}s | '
+              f'{sum(calls.values()) / len(region_data):5.1f} store calls per region '
+              f'({calls["log_batch"]} log_batch) at {args.latency_ms:.0f}ms each')
+
+
+if __name__ == '__main__':
+    main()
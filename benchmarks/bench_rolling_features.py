@@ -0,0 +1,95 @@
+''' Rolling window and calendar features: the groupby / transform implementation against the single pass one
+
+Runs on a synthetic stacked frame of --groups (region, type) groups with a weekly history of each length,
+for each set of window sizes. The previous make_rolling ran four groupby transforms per window size, with a
+Python lambda each. It is reproduced here writing each stat to its own column, so both produce the same
+output, which is checked. The previous make_time_features computed the calendar columns on every row.
+
+Usage: python benchmarks/bench_rolling_features.py [--groups 108] [--weeks 169 520 2000]
+'''
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import common
+import feature_eng
+
+# [1, 4] covers a window of one value, whose sample std is NaN
+WINDOW_SETS = [[12], [1, 4], [4, 12], [4, 8, 12, 26], [4, 8, 12, 26, 52]]
+
+
+def transform_rolling(feat_df, window_sizes, group_keys):
+    for size in window_sizes:
+        for stat in ['mean', 'std', 'max', 'min']:
+            feat_df[f'rolling_{size}_{stat}'] = feat_df.groupby(group_keys)[feature_eng.ROLLING_COLUMN].transform(
+                lambda x: getattr(x.rolling(size), stat)())
+    return feat_df
+
+
+def row_wise_time_features(sel_df):
+    time_feats = pd.DataFrame(index=sel_df.index)
+    dates = sel_df['Date']
+    time_feats['Year'] = dates.dt.year
+    time_feats['MonthSin'] = np.sin(2 * np.pi * dates.dt.month / 12)
+    time_feats['MonthCos'] = np.cos(2 * np.pi * dates.dt.month / 12)
+    time_feats['Day'] = dates.dt.day
+    time_feats['DayofWeekSin'] = np.sin(2 * np.pi * dates.dt.dayofweek / 7)
+    time_feats['DayofWeekCos'] = np.cos(2 * np.pi * dates.dt.dayofweek / 7)
+    time_feats['WeekofYearSin'] = np.sin(2 * np.pi * dates.dt.isocalendar().week / 52)
+    time_feats['WeekofYearCos'] = np.cos(2 * np.pi * dates.dt.isocalendar().week / 52)
+    time_feats['QuarterSin'] = np.sin(2 * np.pi * dates.dt.quarter / 4)
+    time_feats['QuarterCos'] = np.cos(2 * np.pi * dates.dt.quarter / 4)
+    time_feats['TimeIndex'] = ((dates - dates.min()).dt.days) // 7
+    return time_feats
+
+
+def synthetic_frame(n_groups, n_weeks, seed=0):
+    ''' n_groups (Region, Type) groups of n_weeks weekly rows, stacked region by region as in stage 2 '''
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-04', periods=n_weeks, freq='7D')
+    n_regions = -(-n_groups // 2)
+    frame = pd.DataFrame({
+        'Date': np.tile(np.repeat(dates, 2), n_regions),
+        'Region': np.repeat([f'Region{i}' for i in range(n_regions)], 2 * n_weeks),
+        'Type': np.tile(['conventional', 'organic'], n_regions * n_weeks),
+    })
+    frame[feature_eng.ROLLING_COLUMN] = rng.normal(1.4, 0.3, len(frame))
+    # Lagged columns start with missing values
+    frame.loc[frame.groupby(['Region', 'Type']).cumcount() < 4, feature_eng.ROLLING_COLUMN] = np.nan
+    return frame.iloc[:n_groups * n_weeks].reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=108)
+    parser.add_argument('--weeks', type=int, nargs='+', default=[169, 520, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f'{args.groups} groups')
+    for n_weeks in args.weeks:
+        frame = synthetic_frame(args.groups, n_weeks)
+        for window_sizes in WINDOW_SETS:
+            transform_seconds, expected = common.time_call(
+                transform_rolling, frame.copy(), window_sizes, ['Region', 'Type'], repeat=args.repeat)
+            single_pass_seconds, result = common.time_call(
+                feature_eng.make_rolling, frame, window_sizes, ['Region', 'Type'], repeat=args.repeat)
+            pd.testing.assert_frame_equal(result, expected[result.columns], rtol=1e-9)
+            print(f'{n_weeks:>5} weeks | windows {str(window_sizes):<20} | transform {transform_seconds * 1000:8.1f}ms '
+                  f'| single pass {single_pass_seconds * 1000:7.1f}ms '
+                  f'| speed-up {transform_seconds / single_pass_seconds:5.1f}x')
+
+        row_wise_seconds, expected = common.time_call(row_wise_time_features, frame, repeat=args.repeat)
+        feature_eng.calendar_table = None
+        first_seconds, _ = common.time_call(feature_eng.make_time_features, frame)
+        lookup_seconds, result = common.time_call(feature_eng.make_time_features, frame, repeat=args.repeat)
+        pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False)
+        print(f'{n_weeks:>5} weeks | {"calendar features":<28} | row-wise  {row_wise_seconds * 1000:8.1f}ms '
+              f'| lookup      {lookup_seconds * 1000:7.1f}ms '
+              f'| speed-up {row_wise_seconds / lookup_seconds:5.1f}x (first call, building the table: '
+              f'{first_seconds * 1000:.1f}ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+''' Compare the legacy per group apply against the vectorized data_processing.group_by_region
+
+Usage: python benchmarks/bench_stage_1.py [--factors 1 10 100]
+'''
+import argparse
+
+import pandas as pd
+
+import common
+import data_processing
+
+
+def legacy_aggregate_types(group):
+    total_volume = group['TotalVolume'].sum()
+    weighted_avg = (group['AveragePrice'] * group['TotalVolume']).sum() / total_volume
+    return pd.Series({
+        'Date': group['Date'].iloc[0],
+        'Region': group['Region'].iloc[0],
+        'AveragePrice_combined': weighted_avg,
+        'TotalVolume_combined': total_volume,
+        '4046_combined': group['4046'].sum(),
+        '4225_combined': group['4225'].sum(),
+        '4770_combined': group['4770'].sum(),
+        'TotalBags_combined': group['TotalBags'].sum(),
+        'SmallBags_combined': group['SmallBags'].sum(),
+        'LargeBags_combined': group['LargeBags'].sum(),
+        'XLargeBags_combined': group['XLargeBags'].sum(),
+    })
+
+
+def legacy_group_by_region(df):
+    return df.groupby(['Date', 'Region'])[df.columns].apply(legacy_aggregate_types).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--factors', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--skip-legacy', action='store_true', help='Only time the vectorized path')
+    args = parser.parse_args()
+
+    raw_df = common.load_avocado_csv()
+    for factor in args.factors:
+        df = data_processing.preprocess_raw_data(common.enlarge_raw_data(raw_df, factor))
+        new_time, new_df = common.time_call(data_processing.group_by_region, df)
+        line = f'{factor:>4}x ({len(df):>9} rows) vectorized: {new_time:8.3f}s'
+        if not args.skip_legacy:
+            old_time, old_df = common.time_call(legacy_group_by_region, df)
+            pd.testing.assert_frame_equal(old_df, new_df)
+            line += f' | legacy apply: {old_time:8.3f}s | speed-up: {old_time / new_time:7.1f}x'
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+''' One model per region against one global model for all regions: training time, serving memory and test MAPE
+
+Each mode is trained into its own file store, then served by src.api in a fresh process, where the resident
+memory growth over loading the model table and the size of the serialized boosters are measured. Every region
+is then posted its last feature rows, on /predict/{region} and in one /predict/batch request, which must all
+be answered. The aux regions are trained too, so this covers a region the global model also uses as an aux
+region, which has no aux columns of its own to send.
+
+Usage: python benchmarks/bench_training_modes.py [--regions Albany Atlanta | --all-regions] [--registry-dir DIR]
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import common
+import local_registry
+
+
+def check_predictions(client, records):
+    ''' Post the records of every region alone and all together, raising on any response that is not a 200 '''
+    requests = [(f'/predict/{region}', region_records) for region, region_records in records.items()]
+    for path, payload in requests + [('/predict/batch', records)]:
+        response = client.post(path, json=payload)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}: {response.text}')
+
+
+def measure_serving(uri, regions):
+    ''' Runs in a child process: RSS growth of loading every registered model, their booster sizes, and
+    a prediction for every region '''
+    import psutil
+    from src import api  # Imports are not part of what the model table costs
+
+    records = local_registry.sample_records(regions, n_rows=2)
+    rss_before = psutil.Process().memory_info().rss
+    with local_registry.api_client(uri, SERVING_MODE='native', MODEL_LOADING='eager', HISTORY_PATH='') as client:
+        rss_after = psutil.Process().memory_info().rss
+        boosters = {id(entry['booster']): entry['booster'] for entry in api.all_region_models.values()}
+        check_predictions(client, records)
+        print(json.dumps({
+            'rss_mb': (rss_after - rss_before) / 2**20,
+            'boosters': len(boosters),
+            'booster_mb': sum(len(booster.save_raw()) for booster in boosters.values()) / 2**20,
+            'startup_seconds': api.model_load_stats['startup_seconds'],
+        }))
+
+
+def train_mode(mode, region_data, bench_configs, registry_dir):
+    import mlflow
+    import train_models
+
+    uri = local_registry.tracking_uri(registry_dir)
+    mlflow.set_tracking_uri(uri)
+    experiment = mlflow.set_experiment(f'bench_{mode}')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == 'global':
+            results, failures = train_models.train_global_model(region_data, bench_configs, experiment.experiment_id)
+        else:
+            results, failures = train_models.train_all_regions(region_data, bench_configs, experiment.experiment_id)
+    if failures:
+        raise RuntimeError(f'{mode} training failed for {sorted(failures)}')
+    return uri, time.perf_counter() - start, {result['region']: result['test_mape'] for result in results}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', nargs='+', default=None)
+    parser.add_argument('--all-regions', action='store_true')
+    parser.add_argument('--registry-dir', default=None)
+    parser.add_argument('--measure-serving', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.measure_serving:
+        return measure_serving(args.measure_serving, args.regions)
+
+    import configs
+    import feature_store
+    import pandas as pd
+
+    regions = args.regions or list(dict.fromkeys(configs.configs['target_regions'] + configs.configs['aux_regions']))
+    if args.all_regions:
+        regions = sorted(pd.read_csv(common.DATA_PATH, usecols=['region'])['region'].unique())
+    bench_configs = local_registry.benchmark_configs(regions)
+    _, region_data = feature_store.get_features(bench_configs, data_path=common.DATA_PATH)
+
+    registry_root = args.registry_dir or tempfile.mkdtemp(prefix='bench_training_modes_')
+    report = {}
+    for mode in ['per_region', 'global']:
+        uri, train_seconds, mapes = train_mode(mode, region_data, bench_configs, os.path.join(registry_root, mode))
+        serving = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--measure-serving', uri, '--regions', *regions],
+            capture_output=True, text=True, check=True, cwd=common.REPO_DIR)
+        report[mode] = {'train_seconds': train_seconds, 'mapes': mapes, **json.loads(serving.stdout.splitlines()[-1])}
+
+    print(f'{len(region_data)} regions, registries in {registry_root}')
+    for mode, result in report.items():
+        print(f'{mode:>10} | train {result["train_seconds"]:7.2f}s | {result["boosters"]:3d} boosters '
+              f'{result["booster_mb"]:7.2f}MB | serving RSS +{result["rss_mb"]:7.1f}MB '
+              f'| startup {result["startup_seconds"]:6.2f}s | mean MAPE {np.mean(list(result["mapes"].values())):.4f}')
+    print(f'\n{"region":>20} | {"per_region":>10} | {"global":>10}')
+    for region in region_data:
+        print(f'{region:>20} | {report["per_region"]["mapes"][region]:10.4f} | {report["global"]["mapes"][region]:10.4f}')
+
+
+if __name__ == '__main__':
+    main()
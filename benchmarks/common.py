@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELLING_DIR = os.path.join(REPO_DIR, 'modelling')
+DATA_PATH = os.path.join(REPO_DIR, 'data', 'avocado.csv')
+
+# The modelling code is written to run from inside its own folder (see docker-compose.yml)
+if MODELLING_DIR not in sys.path:
+    sys.path.insert(0, MODELLING_DIR)
+
+
+def load_avocado_csv(path=DATA_PATH):
+    return pd.read_csv(path)
+
+
+def enlarge_raw_data(raw_df, factor):
+    ''' Tile the raw avocado.csv rows `factor` times, each copy under renamed regions '''
+    copies = [raw_df]
+    for i in range(1, factor):
+        copy = raw_df.copy()
+        copy['region'] = copy['region'] + f'_{i}'
+        copies.append(copy)
+    return pd.concat(copies, ignore_index=True)
+
+
+def time_call(func, *args, repeat=1, **kwargs):
+    ''' Returns (best wall time in seconds, result of the last call) '''
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
@@ -0,0 +1,137 @@
+''' Load test of /predict/{region} with micro-batching off and on: throughput and tail latency by concurrency
+
+For each setting an API server is started with uvicorn in a subprocess against the local registry. Each
+concurrency level then runs that many clients, each posting its next request as soon as the previous one returns,
+for --duration seconds. Clients spread over --regions in turn.
+
+The clients write raw HTTP/1.1 on keep-alive connections: on a machine with few cores, a full HTTP client
+library spends enough CPU per request at high concurrency to become the bottleneck it is meant to measure.
+
+Usage: python benchmarks/load_test.py [--regions Albany] [--concurrency 1 8 32 64] [--duration 10] [--rows 1]
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+import common
+import local_registry
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def api_server(uri, **env):
+    ''' uvicorn serving src.api in a subprocess, yields its base url once the models are loaded '''
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'src.api:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=common.REPO_DIR, env={**os.environ, 'MLFLOW_TRACKING_URI': uri, **env},
+        stdout=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                httpx.get(f'{url}/models').raise_for_status()
+                break
+            except httpx.HTTPError:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError('API server did not start')
+                time.sleep(0.2)
+        yield url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def post_request(url, path, payload):
+    ''' The bytes of a keep-alive JSON POST request '''
+    body = json.dumps(payload).encode()
+    host = url.split('://', 1)[1]
+    return (f'POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n').encode() + body
+
+
+async def read_response(reader):
+    ''' Status code of the next response on the connection, its body is read and dropped '''
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    lengths = [value for name, value in headers.items() if name.lower() == 'content-length']
+    await reader.readexactly(int(lengths[0]) if lengths else 0)
+    return int(lines[0].split(' ')[1])
+
+
+async def run_load(url, payloads, concurrency, duration):
+    ''' Closed loop load: returns the latencies of the requests completed in `duration` seconds and the errors '''
+    latencies, errors = [], []
+    regions = list(payloads)
+    requests = {region: post_request(url, f'/predict/{region}', payload) for region, payload in payloads.items()}
+    host, port = url.split('://', 1)[1].split(':')
+    stop = time.perf_counter() + duration
+
+    async def worker(i):
+        request = requests[regions[i % len(regions)]]
+        reader, writer = await asyncio.open_connection(host, int(port))
+        try:
+            while time.perf_counter() < stop:
+                start = time.perf_counter()
+                writer.write(request)
+                status = await read_response(reader)
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append(status)
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', nargs='+', default=['Albany'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--rows', type=int, default=1, help='Records per request')
+    parser.add_argument('--serving-mode', default='pyfunc')
+    parser.add_argument('--max-wait-ms', default='2')
+    parser.add_argument('--max-rows', default='256')
+    args = parser.parse_args()
+
+    uri = local_registry.build_local_registry(regions=args.regions)
+    payloads = {region: records[:args.rows] for region, records in local_registry.sample_records(
+        args.regions, n_rows=args.rows).items()}
+
+    for micro_batching in ['false', 'true']:
+        env = {
+            'SERVING_MODE': args.serving_mode, 'MICRO_BATCHING': micro_batching,
+            'MICRO_BATCH_MAX_WAIT_MS': args.max_wait_ms, 'MICRO_BATCH_MAX_ROWS': args.max_rows,
+            # Every client repeats its payload, the cache would answer all but the first
+            'PREDICTION_CACHE_SIZE': '0'}
+        with api_server(uri, **env) as url:
+            for concurrency in args.concurrency:
+                latencies, errors = asyncio.run(run_load(url, payloads, concurrency, args.duration))
+                latencies_ms = np.asarray(latencies) * 1000
+                print(f'micro-batching {micro_batching:>5} | {concurrency:>4} clients | '
+                      f'{len(latencies) / args.duration:8.1f} req/s | p50 {np.percentile(latencies_ms, 50):7.2f}ms '
+                      f'| p95 {np.percentile(latencies_ms, 95):7.2f}ms | p99 {np.percentile(latencies_ms, 99):7.2f}ms'
+                      + (f' | {len(errors)} errors' if errors else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+''' Stand-in for the MLflow server: a file based tracking store and model registry filled by the real training code '''
+import contextlib
+import copy
+import io
+import json
+import os
+import sys
+
+import common
+import configs
+import feature_store
+
+DEFAULT_REGISTRY_DIR = os.path.join(common.REPO_DIR, 'benchmarks', '.mlruns')
+
+# src/api.py is imported as src.api, like uvicorn does in docker-compose.yml
+if common.REPO_DIR not in sys.path:
+    sys.path.insert(0, common.REPO_DIR)
+
+
+def benchmark_configs(regions=None, **overrides):
+    bench_configs = copy.deepcopy(configs.configs)
+    bench_configs['feature_cache_dir'] = None
+    if regions:
+        bench_configs['target_regions'] = list(regions)
+    bench_configs.update(overrides)
+    return bench_configs
+
+
+def tracking_uri(registry_dir=DEFAULT_REGISTRY_DIR):
+    # A plain path rather than a file: URI, so model sources are plain paths that mlflow.models.Model.load accepts
+    return os.path.abspath(registry_dir)
+
+
+def build_local_registry(registry_dir=DEFAULT_REGISTRY_DIR, regions=None, experiment_name='benchmarks'):
+    ''' Train and register one model per region into a file store, regions already registered are skipped '''
+    import mlflow
+    import train_models
+
+    uri = tracking_uri(registry_dir)
+    mlflow.set_tracking_uri(uri)
+    client = mlflow.MlflowClient()
+    registered = {model.name for model in client.search_registered_models()}
+
+    bench_configs = benchmark_configs(regions)
+    missing = [
+        region for region in bench_configs['target_regions'] if f'{region}_AVOCADO_FORECAST' not in registered]
+    if missing:
+        bench_configs['target_regions'] = missing
+        _, region_data = feature_store.get_features(bench_configs, data_path=common.DATA_PATH)
+        experiment = mlflow.set_experiment(experiment_name)
+        with contextlib.redirect_stdout(io.StringIO()):
+            train_models.train_all_regions(region_data, bench_configs, experiment.experiment_id)
+    return uri
+
+
+def sample_records(regions, n_rows=4):
+    ''' Last n_rows complete feature rows of every region, as the JSON records a client would post '''
+    _, region_data = feature_store.get_features(benchmark_configs(regions), data_path=common.DATA_PATH)
+    return {
+        region: json.loads(X.dropna().tail(n_rows).to_json(orient='records')) for region, (X, _, _) in region_data.items()}
+
+
+@contextlib.contextmanager
+def api_client(uri, **env):
+    ''' TestClient on src.api with the lifespan (model loading) run against the given tracking uri '''
+    from fastapi.testclient import TestClient
+
+    # The TestClient sends one request at a time, there is nothing for micro-batching to coalesce, and the
+    # benchmarks repeat their payloads, which the prediction cache would answer
+    env = {'MICRO_BATCHING': 'false', 'PREDICTION_CACHE_SIZE': '0', **env}
+    previous = {key: os.environ.get(key) for key in ['MLFLOW_TRACKING_URI', *env]}
+    os.environ['MLFLOW_TRACKING_URI'] = uri
+    os.environ.update(env)
+    try:
+        from src import api
+        with contextlib.redirect_stdout(io.StringIO()):
+            client = TestClient(api.app)
+            client.__enter__()
+        try:
+            yield client
+        finally:
+            with contextlib.redirect_stdout(io.StringIO()):
+                client.__exit__(None, None, None)
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
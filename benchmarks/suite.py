@@ -0,0 +1,283 @@
+''' Benchmark suite on synthetic avocado data: pipeline, training and API timings written to JSON
+
+Generates a --regions x --types x --weeks avocado.csv (benchmarks/synthetic.py) and runs on it:
+- stage_1: data_processing.make_stage_1_data on the generated file
+- stage_2: feature_eng.make_stage_2_data_all_regions for every region, stage_2_region make_stage_2_data for one
+- train: train_models.train_all_regions on the first --train-regions regions, into a file based MLflow store
+- api_startup, predict_<mode>_<rows>: the FastAPI app on that store through the TestClient, --requests posts
+  to /predict/{region} per request size and serving mode
+- reload_unchanged, reload_changed: /reload-models with no new version, and with a new version of one model
+
+Wall times are the best of --repeat runs (training, startup and reloads run once). Peak memory is the peak of
+traced allocations (numpy and pandas buffers, not XGBoost's) in one more run with tracemalloc on, so tracing
+does not slow the timed runs. RSS after each step and the process peak RSS are recorded too.
+
+The JSON file (default benchmarks/results/<commit>.json) holds the commit, the machine and the data sizes with
+the results. --compare prints the change of every metric between two files and exits with 1 when one got worse
+by more than --threshold.
+
+Usage: python benchmarks/suite.py [--regions 54] [--types 2] [--weeks 169] [--train-regions 4] [--output path]
+       python benchmarks/suite.py --compare old.json new.json [--threshold 1.2]
+'''
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+import common
+import local_registry
+import synthetic
+
+RESULTS_DIR = os.path.join(common.REPO_DIR, 'benchmarks', 'results')
+# Metrics compared by --compare, and whether a higher value is better
+COMPARED_METRICS = {
+    'wall_seconds': False, 'peak_traced_mb': False, 'p50_ms': False, 'p99_ms': False,
+    'rows_per_second': True, 'requests_per_second': True, 'regions_per_second': True}
+
+
+def git_output(*args):
+    try:
+        return subprocess.run(
+            ['git', *args], cwd=common.REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import mlflow
+    import pandas as pd
+    import xgboost
+
+    return {
+        'commit': git_output('rev-parse', 'HEAD'),
+        'dirty': bool(git_output('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'packages': {
+            'numpy': np.__version__, 'pandas': pd.__version__, 'xgboost': xgboost.__version__,
+            'mlflow': mlflow.__version__},
+    }
+
+
+def measure(func, *args, repeat=1, **kwargs):
+    ''' Best wall time of `repeat` calls, then the peak traced memory of one more call. Returns (record, result) '''
+    import profiling
+
+    seconds, result = common.time_call(func, *args, repeat=repeat, **kwargs)
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'wall_seconds': seconds, 'peak_traced_mb': peak / 2**20, 'rss_mb': profiling.rss_mb()}, result
+
+
+def latency_record(latencies, n_rows):
+    latencies = np.asarray(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'requests_per_second': len(latencies) / float(latencies.sum()),
+        'rows_per_second': len(latencies) * n_rows / float(latencies.sum()),
+    }
+
+
+def wait_for_reload(client, poll_seconds=0.005):
+    ''' Start a reload and return its wall time and report once the background thread is done '''
+    start = time.perf_counter()
+    client.post('/reload-models').raise_for_status()
+    while True:
+        status = client.get('/reload-models').json()
+        if status['state'] != 'running':
+            break
+        time.sleep(poll_seconds)
+    if status['state'] == 'failed':
+        raise RuntimeError(f"Reload failed: {status['error']}")
+    return time.perf_counter() - start, status['last_reload']
+
+
+def run_pipeline(args, data_path, n_raw_rows, results):
+    import data_processing
+    import feature_eng
+
+    regions = synthetic.region_names(args.regions)
+    bench_configs = local_registry.benchmark_configs(regions)
+
+    results['stage_1'], merge_df = measure(
+        data_processing.make_stage_1_data, bench_configs, data_path, repeat=args.repeat)
+    results['stage_1']['rows_per_second'] = n_raw_rows / results['stage_1']['wall_seconds']
+
+    results['stage_2'], region_data = measure(
+        feature_eng.make_stage_2_data_all_regions, merge_df, regions, bench_configs, repeat=args.repeat)
+    n_rows = sum(len(X) for X, _, _ in region_data.values())
+    results['stage_2']['rows_per_second'] = n_rows / results['stage_2']['wall_seconds']
+
+    results['stage_2_region'], (X, _, _) = measure(
+        feature_eng.make_stage_2_data, merge_df, regions[1 % len(regions)], bench_configs, repeat=args.repeat)
+    results['stage_2_region']['rows_per_second'] = len(X) / results['stage_2_region']['wall_seconds']
+    return region_data
+
+
+def run_training(args, region_data, tracking_uri, results):
+    import mlflow
+    import profiling
+    import train_models
+
+    # TotalUS is the aux region, the trained regions are the ones after it
+    train_regions = synthetic.region_names(args.regions)[1:args.train_regions + 1] or ['TotalUS']
+    bench_configs = local_registry.benchmark_configs(train_regions, log_plots=args.log_plots)
+    mlflow.set_tracking_uri(tracking_uri)
+    experiment = mlflow.set_experiment('benchmark_suite')
+    with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+        # The synthetic regions have no tuned params and train with the defaults
+        warnings.filterwarnings('ignore', message='No best parameters found')
+        start = time.perf_counter()
+        train_results, failures = train_models.train_all_regions(
+            {region: region_data[region] for region in train_regions}, bench_configs, experiment.experiment_id)
+        seconds = time.perf_counter() - start
+    if failures:
+        raise RuntimeError(f'Training failed: {failures}')
+    results['train'] = {
+        'regions': len(train_results),
+        'wall_seconds': seconds,
+        'regions_per_second': len(train_results) / seconds,
+        'mean_region_seconds': float(np.mean([result['seconds'] for result in train_results])),
+        'rss_mb': profiling.rss_mb(),
+    }
+    return train_regions
+
+
+def run_api(args, region_data, train_regions, tracking_uri, results):
+    import mlflow
+
+    region = train_regions[0]
+    history = json.loads(region_data[region][0].dropna().to_json(orient='records'))
+    for serving_mode in args.serving_modes:
+        start = time.perf_counter()
+        with local_registry.api_client(tracking_uri, SERVING_MODE=serving_mode) as client:
+            results[f'api_startup_{serving_mode}'] = {'wall_seconds': time.perf_counter() - start}
+            for n_rows in args.rows:
+                records = (history * (n_rows // len(history) + 1))[-n_rows:]
+                latencies = []
+                for _ in range(args.requests):
+                    request_start = time.perf_counter()
+                    client.post(f'/predict/{region}', json=records).raise_for_status()
+                    latencies.append(time.perf_counter() - request_start)
+                results[f'predict_{serving_mode}_{n_rows}'] = latency_record(latencies, n_rows)
+
+    with local_registry.api_client(tracking_uri) as client:
+        seconds, _ = wait_for_reload(client)
+        results['reload_unchanged'] = {'wall_seconds': seconds}
+
+        # A new version of the first model, registered from the same artifacts
+        mlflow_client = mlflow.MlflowClient()
+        model_name = f'{region}_AVOCADO_FORECAST'
+        latest = max(mlflow_client.search_model_versions(f"name='{model_name}'"), key=lambda v: int(v.version))
+        mlflow_client.create_model_version(model_name, latest.source, latest.run_id, tags={'region': region})
+        seconds, report = wait_for_reload(client)
+        results['reload_changed'] = {'wall_seconds': seconds, 'models_loaded': len(report['changed'])}
+
+
+def compare(old_path, new_path, threshold):
+    ''' Print the ratio of every compared metric, returns the regressions beyond threshold '''
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    if old['data'] != new['data']:
+        print(f"Warning: the data sizes differ, {old['data']} against {new['data']}")
+    print(f"{old['environment']['commit'] or old_path} -> {new['environment']['commit'] or new_path}")
+    regressions = []
+    for step, new_record in new['results'].items():
+        old_record = old['results'].get(step, {})
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in new_record or not old_record.get(metric):
+                continue
+            ratio = new_record[metric] / old_record[metric]
+            # How many times worse the new value is, below 1 for an improvement
+            worse = (1 / ratio if ratio else float('inf')) if higher_is_better else ratio
+            flag = ' REGRESSION' if worse > threshold else ''
+            print(f'{step:<24} {metric:<20} {old_record[metric]:12.4f} -> {new_record[metric]:12.4f} '
+                  f'({ratio:5.2f}x){flag}')
+            if flag:
+                regressions.append((step, metric, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', type=int, default=54)
+    parser.add_argument('--types', type=int, default=2)
+    parser.add_argument('--weeks', type=int, default=169)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--train-regions', type=int, default=4)
+    parser.add_argument('--log-plots', action='store_true', help='Plot the test predictions while training')
+    parser.add_argument('--serving-modes', nargs='+', default=['pyfunc', 'native'])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--requests', type=int, default=200, help='Requests per request size and serving mode')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--steps', nargs='+', choices=['pipeline', 'train', 'api'], default=['pipeline', 'train', 'api'],
+                        help='The pipeline always runs, the api step trains the models it serves first')
+    parser.add_argument('--output', help='Defaults to benchmarks/results/<commit>.json')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=1.2, help='Slow-down ratio --compare reports')
+    args = parser.parse_args()
+
+    if args.compare:
+        regressions = compare(*args.compare, args.threshold)
+        print(f'{len(regressions)} regressions beyond {args.threshold}x')
+        sys.exit(1 if regressions else 0)
+
+    import profiling
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_path = os.path.join(work_dir, 'avocado.csv')
+        start = time.perf_counter()
+        frame = synthetic.write_avocado_csv(
+            data_path, n_regions=args.regions, n_types=args.types, n_weeks=args.weeks, seed=args.seed)
+        print(f'Generated {len(frame)} rows in {time.perf_counter() - start:.2f}s')
+        data = {'regions': args.regions, 'types': args.types, 'weeks': args.weeks, 'seed': args.seed,
+                'raw_rows': len(frame)}
+        del frame
+
+        region_data = run_pipeline(args, data_path, data['raw_rows'], results)
+        tracking_uri = os.path.join(work_dir, 'mlruns')
+        if 'train' in args.steps or 'api' in args.steps:
+            train_regions = run_training(args, region_data, tracking_uri, results)
+            if 'api' in args.steps:
+                run_api(args, region_data, train_regions, tracking_uri, results)
+
+    for step, record in results.items():
+        print(f'{step:<24} ' + ' | '.join(
+            f'{metric} {value:.4g}' for metric, value in record.items() if isinstance(value, (int, float))))
+
+    report = {
+        'environment': {**environment(), 'max_rss_mb': profiling.max_rss_mb()},
+        'data': data,
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{(report['environment']['commit'] or 'results')[:12]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+''' Synthetic avocado data in the avocado.csv schema, with any number of regions, types and weeks
+
+Every (region, type) series has a weekly price with a type level, a region offset, a yearly cycle and AR(1)
+noise, and a volume that falls as the price rises, split into PLU codes and bag sizes that add up as in the
+real file. The first region is TotalUS, the aux region of the default configs. The first two types are
+conventional and organic, further ones are named type2, type3 and so on.
+
+Usage: python benchmarks/synthetic.py <output.csv> [--regions 54] [--types 2] [--weeks 169]
+'''
+import argparse
+
+import numpy as np
+import pandas as pd
+
+CSV_COLUMNS = [
+    'Date', 'AveragePrice', 'Total Volume', '4046', '4225', '4770', 'Total Bags', 'Small Bags', 'Large Bags',
+    'XLarge Bags', 'type', 'year', 'region']
+
+
+def region_names(n_regions):
+    return ['TotalUS'] + [f'Region{i:04d}' for i in range(n_regions - 1)]
+
+
+def type_names(n_types):
+    return (['conventional', 'organic'] + [f'type{i}' for i in range(2, n_types)])[:n_types]
+
+
+def make_avocado_frame(n_regions=54, n_types=2, n_weeks=169, start='2015-01-04', missing_fraction=0.0, seed=0):
+    ''' Raw rows as pd.read_csv returns them for avocado.csv, one per region, type and week '''
+    rng = np.random.default_rng(seed)
+    regions, types = region_names(n_regions), type_names(n_types)
+    dates = pd.date_range(start, periods=n_weeks, freq='7D')
+    n_series = n_regions * n_types
+
+    # Series are ordered region major: series i is region i // n_types and type i % n_types
+    type_level = np.tile(1.1 + 0.45 * np.arange(n_types), n_regions)
+    region_offset = np.repeat(rng.normal(0, 0.12, n_regions), n_types)
+    phase = rng.uniform(0, 2 * np.pi, n_series)
+    noise = rng.normal(0, 0.04, (n_series, n_weeks))
+    for week in range(1, n_weeks):
+        noise[:, week] += 0.8 * noise[:, week - 1]
+    season = 0.12 * np.sin(2 * np.pi * np.arange(n_weeks) / 52 + phase[:, None])
+    price = np.clip(type_level[:, None] + region_offset[:, None] + season + noise, 0.4, None)
+
+    # TotalUS sells about as much as all the other regions together
+    region_scale = np.exp(rng.normal(11, 1, n_regions))
+    region_scale[0] = region_scale[1:].sum() if n_regions > 1 else region_scale[0]
+    type_share = np.tile(0.1 ** np.arange(n_types), n_regions)
+    volume = (np.repeat(region_scale, n_types) * type_share)[:, None] * np.exp(
+        -1.2 * (price - type_level[:, None]) + rng.normal(0, 0.1, (n_series, n_weeks)))
+
+    plu_shares = rng.dirichlet([6, 6, 0.5, 4], (n_series, n_weeks))
+    bag_shares = rng.dirichlet([8, 2.5, 0.2], (n_series, n_weeks))
+    plu = volume[..., None] * plu_shares[..., :3]
+    total_bags = volume * plu_shares[..., 3]
+    bags = total_bags[..., None] * bag_shares
+
+    frame = pd.DataFrame({
+        'Date': np.tile(dates.strftime('%Y-%m-%d'), n_series),
+        'AveragePrice': price.ravel(),
+        'Total Volume': volume.ravel(),
+        '4046': plu[..., 0].ravel(),
+        '4225': plu[..., 1].ravel(),
+        '4770': plu[..., 2].ravel(),
+        'Total Bags': total_bags.ravel(),
+        'Small Bags': bags[..., 0].ravel(),
+        'Large Bags': bags[..., 1].ravel(),
+        'XLarge Bags': bags[..., 2].ravel(),
+        'type': np.repeat(np.tile(types, n_regions), n_weeks),
+        'year': np.tile(dates.year, n_series),
+        'region': np.repeat(regions, n_types * n_weeks),
+    }, columns=CSV_COLUMNS).round(2)
+    if missing_fraction:
+        frame = frame[rng.random(len(frame)) >= missing_fraction].reset_index(drop=True)
+    return frame
+
+
+def write_avocado_csv(path, **kwargs):
+    ''' Write a synthetic frame to `path` with the unnamed index column of avocado.csv, returns the frame '''
+    frame = make_avocado_frame(**kwargs)
+    frame.to_csv(path)
+    return frame
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('output')
+    parser.add_argument('--regions', type=int, default=54)
+    parser.add_argument('--types', type=int, default=2)
+    parser.add_argument('--weeks', type=int, default=169)
+    parser.add_argument('--missing-fraction', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    frame = write_avocado_csv(
+        args.output, n_regions=args.regions, n_types=args.types, n_weeks=args.weeks,
+        missing_fraction=args.missing_fraction, seed=args.seed)
+    print(f'Wrote {len(frame)} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
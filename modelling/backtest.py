@@ -0,0 +1,182 @@
+''' Walk-forward backtest of the per region models over many forecast origins.
+
+At each origin the model is trained on every week up to the origin and scored on the following
+`backtest_horizon_weeks` weeks, which the lag >= 4 features can forecast from the origin. Each region's
+features go into one DMatrix, and folds are index slices of it. Folds run in parallel threads, and regions
+in parallel processes. With `backtest_warm_start`, each origin instead continues boosting the previous
+origin's model for `backtest_warm_start_rounds` rounds on the extended history. This is much cheaper, but it
+is not the same model a refit would give.
+
+Everything is logged to one MLflow run: aggregated metrics per region and a single backtest.json artifact
+with the per origin errors of every region.
+
+Usage: python backtest.py [region ...]
+'''
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import mlflow
+import numpy as np
+import xgboost as xgb
+
+import train_models
+
+
+def make_origins(dates, configs):
+    ''' Forecast origins (array of dates): every `backtest_step_weeks` weeks, after `backtest_min_train_weeks` weeks of history '''
+    weeks = np.unique(dates)
+    horizon = configs.get('backtest_horizon_weeks', 4)
+    candidates = weeks[configs.get('backtest_min_train_weeks', 52) - 1:len(weeks) - horizon]
+    return candidates[::configs.get('backtest_step_weeks', 4)]
+
+
+def booster_params(params, n_jobs=None):
+    ''' XGBRegressor params (as load_best_params returns them) to xgb.train params and boosting rounds '''
+    params = dict(params)
+    num_boost_round = params.pop('n_estimators', 100)
+    params = {'objective': 'reg:squarederror', 'tree_method': 'hist', **params}
+    if n_jobs is not None:
+        params['nthread'] = n_jobs
+    return params, num_boost_round
+
+
+def score_fold(booster, dmatrix, y, test_rows):
+    y_true = y[test_rows]
+    y_pred = booster.predict(dmatrix.slice(test_rows))
+    return {
+        'mape': float(np.mean(np.abs((y_true - y_pred) / y_true))),
+        'mse': float(np.mean((y_true - y_pred) ** 2)),
+    }
+
+
+def backtest_region(region, X, y, dates, configs, n_jobs=None):
+    ''' Per origin errors of a region and the seconds it took '''
+    start = time.perf_counter()
+    warm_start = configs.get('backtest_warm_start', False)
+    # Parallel folds get one XGBoost thread each
+    params, num_boost_round = booster_params(train_models.load_best_params(region), n_jobs if warm_start else 1)
+    dmatrix = xgb.DMatrix(X, label=y, enable_categorical=True)
+    y = y.to_numpy()
+    dates = dates.to_numpy()
+    horizon = np.timedelta64(7 * configs.get('backtest_horizon_weeks', 4), 'D')
+
+    folds = []
+    for origin in make_origins(dates, configs):
+        train_rows = np.flatnonzero(dates <= origin)
+        test_rows = np.flatnonzero((dates > origin) & (dates <= origin + horizon))
+        folds.append((origin, train_rows, test_rows))
+
+    def run_fold(fold, previous=None):
+        origin, train_rows, test_rows = fold
+        if previous is None:
+            booster = xgb.train(params, dmatrix.slice(train_rows), num_boost_round=num_boost_round)
+        else:
+            booster = xgb.train(
+                params, dmatrix.slice(train_rows),
+                num_boost_round=configs.get('backtest_warm_start_rounds', 10), xgb_model=previous)
+        return booster, {'origin': str(origin.astype('datetime64[D]')), **score_fold(booster, dmatrix, y, test_rows)}
+
+    if warm_start:
+        # Each origin builds on the previous one, so folds run in order
+        origins, booster = [], None
+        for fold in folds:
+            booster, scores = run_fold(fold, booster)
+            origins.append(scores)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count() or 1) as executor:
+            origins = [scores for _, scores in executor.map(run_fold, folds)]
+
+    return {'region': region, 'origins': origins, 'seconds': time.perf_counter() - start}
+
+
+def summarize(origins):
+    mapes = np.array([origin['mape'] for origin in origins])
+    return {
+        'mape_mean': float(mapes.mean()),
+        'mape_median': float(np.median(mapes)),
+        'mape_p90': float(np.percentile(mapes, 90)),
+        'mse_mean': float(np.mean([origin['mse'] for origin in origins])),
+        'n_origins': len(origins),
+    }
+
+
+def backtest_all_regions(region_data, configs):
+    ''' Backtest every region, in a process pool when configs['n_workers'] != 1.
+
+    Returns (results, failures) like train_models.train_all_regions.
+    '''
+    regions = list(region_data)
+    n_workers, n_jobs = train_models.split_cores(configs.get('n_workers', 1), len(regions))
+    results, failures = [], {}
+
+    if n_workers == 1:
+        for region in regions:
+            try:
+                results.append(backtest_region(region, *region_data[region], configs, n_jobs))
+            except Exception:
+                failures[region] = traceback.format_exc()
+        return results, failures
+
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = {
+            executor.submit(backtest_region, region, *region_data[region], configs, n_jobs): region
+            for region in regions}
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception:
+                failures[futures[future]] = traceback.format_exc()
+    return results, failures
+
+
+def log_backtest(results, configs):
+    ''' One MLflow run: summary metrics per region and overall, plus the per origin errors as backtest.json '''
+    summaries = {result['region']: summarize(result['origins']) for result in results}
+    with mlflow.start_run(run_name='Backtest'):
+        mlflow.log_params({
+            key: configs.get(key) for key in [
+                'backtest_horizon_weeks', 'backtest_step_weeks', 'backtest_min_train_weeks',
+                'backtest_warm_start', 'backtest_warm_start_rounds']})
+        metrics = {
+            f'backtest_{name}_{region}': value
+            for region, summary in summaries.items() for name, value in summary.items() if name != 'n_origins'}
+        metrics['backtest_mape_mean'] = float(np.mean([summary['mape_mean'] for summary in summaries.values()]))
+        mlflow.log_metrics(metrics)
+        mlflow.log_dict(
+            {result['region']: {'summary': summaries[result['region']], 'origins': result['origins']}
+             for result in results},
+            'backtest.json')
+    return summaries
+
+
+def main(experiment_name=os.getenv('EXPERIMENT_NAME')):
+    import configs
+    import feature_store
+
+    backtest_configs = dict(configs.configs)
+    if sys.argv[1:]:
+        backtest_configs['target_regions'] = sys.argv[1:]
+    mlflow.set_tracking_uri(os.getenv('MLFLOW_TRACKING_URI'))
+    _, region_data = feature_store.get_features(backtest_configs)
+    mlflow.set_experiment(experiment_name)
+
+    start = time.perf_counter()
+    results, failures = backtest_all_regions(region_data, backtest_configs)
+    summaries = log_backtest(results, backtest_configs)
+    for region, summary in sorted(summaries.items()):
+        print(f"{region:<22} {summary['n_origins']:3d} origins  mape mean={summary['mape_mean']:.4f} "
+              f"median={summary['mape_median']:.4f} p90={summary['mape_p90']:.4f}")
+    for region, error in failures.items():
+        print(f'FAILED {region}:\n{error}')
+    print(f'Backtested {len(results)} regions in {time.perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    main()
@@ -55,5 +55,53 @@ configs = {
         # "TotalBags_combined", "SmallBags_combined", 
         # "LargeBags_combined", "XLargeBags_combined"
     ],
-    "aux_lags": [4]
-}
\ No newline at end of file
+    "aux_lags": [4],
+    # Stage 1 / stage 2 frames are cached here, keyed by the data file and the feature configs above.
+    # Set to None to always rebuild
+    "feature_cache_dir": "feature_cache",
+    "feature_cache_max_mb": 1024,
+    # Set to a directory to train from the incremental store filled by ingestion.py (weekly appended feeds)
+    # instead of rebuilding from data/avocado.csv
+    "incremental_store_dir": None,
+    "ingestion_chunksize": 50_000,
+    # "per_region" trains one model per target region, "global" one model for all of them with the region
+    # as a categorical feature, registered as GLOBAL_AVOCADO_FORECAST and served behind the same endpoints
+    "training_mode": "per_region",
+    "global_model_params": {
+        "n_estimators": 300,
+        "learning_rate": 0.05,
+        "max_depth": 6,
+        "subsample": 0.9,
+        "colsample_bytree": 0.8,
+    },
+    # Re-tune the per region params (tuning.py) before training and write them to region_best_params.json
+    "tune_params": False,
+    "tuning_n_trials": 50,
+    "tuning_timeout_seconds": None,  # Per region
+    "tuning_n_splits": 4,
+    "tuning_max_rounds": 500,
+    "tuning_early_stopping_rounds": 20,
+    "tuning_n_jobs": None,  # Parallel trials, None uses every core
+    "tuning_seed": 0,
+    # Walk-forward backtest (backtest.py): an origin every step weeks after min_train weeks of history,
+    # each scored on the next horizon weeks. Warm start continues the previous origin's model instead of refitting
+    "backtest_horizon_weeks": 4,
+    "backtest_step_weeks": 4,
+    "backtest_min_train_weeks": 52,
+    "backtest_warm_start": False,
+    "backtest_warm_start_rounds": 10,
+    # Threads uploading finished runs (params, metrics, plot, model, registration) to MLflow while training goes on
+    "mlflow_upload_workers": 4,
+    # Log a plot of the test predictions with each region's run, False skips plotting and importing matplotlib
+    "log_plots": True,
+    # Per stage / per region wall and CPU time and RSS, written to profile_dir/<timestamp>/summary.json and logged
+    # to MLflow as a "Training profile" run. profile_memory adds tracemalloc peaks (slower), profiler is None,
+    # "cprofile" or "sampling" (collapsed stacks of the main thread)
+    "profile": False,
+    "profile_memory": False,
+    "profiler": None,
+    "profile_dir": "profiles",
+    # Regions trained in parallel processes, 1 trains serially and None uses every core.
+    # XGBoost n_jobs is set to cores // n_workers so the two don't oversubscribe
+    "n_workers": 1,
+}
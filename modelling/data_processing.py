@@ -1,9 +1,11 @@
 import pandas as pd
-import shutil
-import os
-import kagglehub
+
+import profiling
+
+DATA_PATH = 'data/avocado.csv'
 
 def load_raw_data():
+    # data/avocado.csv ships with the repo. To download it again (needs kagglehub, shutil and os):
     # # Download latest version
     # path = kagglehub.dataset_download("neuromusic/avocado-prices")
 
@@ -24,31 +26,23 @@ def preprocess_raw_data(df):
     df['Date'] = pd.to_datetime(df['Date'])
     df = df.sort_values('Date')
     # df = df.set_index('Date')
-    df = df.drop(['Unnamed: 0', 'year'], axis=1)
+    df = df.drop(['Unnamed: 0', 'year'], axis=1, errors='ignore')
     df.columns = df.columns.str.strip()
     df.columns = df.columns.str.replace(' ', '')
     df.columns = df.columns.str[0].str.upper() + df.columns.str[1:]
     return df
 
-def aggregate_types(group):
-    total_volume = group['TotalVolume'].sum()
-    weighted_avg = (group['AveragePrice'] * group['TotalVolume']).sum() / total_volume
-    return pd.Series({
-        'Date': group['Date'].iloc[0],
-        'Region': group['Region'].iloc[0],
-        'AveragePrice_combined': weighted_avg,
-        'TotalVolume_combined': total_volume,
-        '4046_combined': group['4046'].sum(),
-        '4225_combined': group['4225'].sum(),
-        '4770_combined': group['4770'].sum(),
-        'TotalBags_combined': group['TotalBags'].sum(),
-        'SmallBags_combined': group['SmallBags'].sum(),
-        'LargeBags_combined': group['LargeBags'].sum(),
-        'XLargeBags_combined': group['XLargeBags'].sum(),
-    })
+SUMMED_COLUMNS = ['TotalVolume', '4046', '4225', '4770', 'TotalBags', 'SmallBags', 'LargeBags', 'XLargeBags']
 
 def group_by_region(df):
-    combined_df = df.groupby(['Date', 'Region'])[df.columns].apply(aggregate_types).reset_index(drop=True)
+    ''' Combine the types of each (Date, Region) pair: volume weighted price and summed volumes '''
+    # Weighted sum is plain column arithmetic, so a single groupby().sum() replaces the per group apply
+    weighted = df[['Date', 'Region'] + SUMMED_COLUMNS].copy()
+    weighted['AveragePrice'] = df['AveragePrice'] * df['TotalVolume']
+    combined_df = weighted.groupby(['Date', 'Region'], sort=True).sum().reset_index()
+    combined_df['AveragePrice'] = combined_df['AveragePrice'] / combined_df['TotalVolume']
+    combined_df = combined_df[['Date', 'Region', 'AveragePrice'] + SUMMED_COLUMNS]
+    combined_df.columns = ['Date', 'Region'] + [f'{col}_combined' for col in ['AveragePrice'] + SUMMED_COLUMNS]
     return combined_df
 
 def pivot_and_merge_numerical_columns(df, grouped_df, target_name):
@@ -60,10 +54,13 @@ def pivot_and_merge_numerical_columns(df, grouped_df, target_name):
     merge_df = pd.merge(merge_df, df[['Region', 'Date', 'Type', target_name]], on=['Date', 'Region', 'Type'], how='left')
     return merge_df
 
-def make_stage_1_data(configs):
+def make_stage_1_data(configs, data_path=DATA_PATH):
     # df = load_raw_data()
-    df = pd.read_csv('data/avocado.csv')
-    df = preprocess_raw_data(df)
-    grouped_df = group_by_region(df)
-    merge_df = pivot_and_merge_numerical_columns(df, grouped_df, configs['target_name'])
+    with profiling.stage('read_csv'):
+        df = pd.read_csv(data_path)
+        df = preprocess_raw_data(df)
+    with profiling.stage('group_by_region'):
+        grouped_df = group_by_region(df)
+    with profiling.stage('pivot_and_merge'):
+        merge_df = pivot_and_merge_numerical_columns(df, grouped_df, configs['target_name'])
     return merge_df
@@ -1,6 +1,12 @@
 import pandas as pd
 import numpy as np
 
+import profiling
+
+# make_rolling computes its windows on this column, each stat into its own column
+ROLLING_COLUMN = 'AveragePrice_combined_lag_4'
+ROLLING_STATS = ['mean', 'std', 'min', 'max']
+
 def make_lags_single_column(sel_df, lags, lag_column, region_name=False):
     ''' Create lag features for a single region and lag column '''
     # TODO Raise error if sel_df has multiple regions
@@ -52,34 +58,135 @@ def make_target_region_lags_df(merge_df, target_region, configs):
 
     return target_region_lags_df
 
+def make_calendar_table(dates):
+    ''' Calendar features of each distinct date, indexed by date '''
+    dates = pd.DatetimeIndex(dates)
+    month, quarter = dates.month.to_numpy(), dates.quarter.to_numpy()
+    dayofweek = dates.dayofweek.to_numpy()
+    week = dates.isocalendar()['week'].to_numpy(dtype='float64')
+    return pd.DataFrame({
+        'Year': dates.year.to_numpy(dtype='int32'),
+        'MonthSin': np.sin(2 * np.pi * month / 12),
+        'MonthCos': np.cos(2 * np.pi * month / 12),
+        'Day': dates.day.to_numpy(dtype='int32'),
+        'DayofWeekSin': np.sin(2 * np.pi * dayofweek / 7),
+        'DayofWeekCos': np.cos(2 * np.pi * dayofweek / 7),
+        'WeekofYearSin': np.sin(2 * np.pi * week / 52),
+        'WeekofYearCos': np.cos(2 * np.pi * week / 52),
+        'QuarterSin': np.sin(2 * np.pi * quarter / 4),
+        'QuarterCos': np.cos(2 * np.pi * quarter / 4),
+    }, index=dates)
+
+# Calendar features of every date seen so far, shared by all regions and extended when new dates show up
+calendar_table = None
+
+def lookup_calendar(dates):
+    ''' Calendar features of each row, read from the shared table, NaN on rows without a date '''
+    global calendar_table
+    distinct_dates = pd.DatetimeIndex(dates.dropna().unique())
+    if calendar_table is None:
+        calendar_table = make_calendar_table(distinct_dates)
+    else:
+        new_dates = distinct_dates.difference(calendar_table.index)
+        if len(new_dates):
+            calendar_table = pd.concat([calendar_table, make_calendar_table(new_dates)])
+
+    positions = calendar_table.index.get_indexer(dates)
+    missing = positions < 0
+    calendar = {}
+    for col in calendar_table.columns:
+        values = calendar_table[col].to_numpy()[positions]
+        if missing.any():
+            values = values.astype('float64')
+            values[missing] = np.nan
+        calendar[col] = values
+    return pd.DataFrame(calendar, index=dates.index)
+
 def make_time_features(sel_df):
-    time_feats = pd.DataFrame(index=sel_df.index)
     dates = sel_df['Date']
-    time_feats['Year'] = dates.dt.year
-    time_feats['MonthSin'] = np.sin(2 * np.pi * dates.dt.month/ 12)
-    time_feats['MonthCos'] = np.cos(2 * np.pi * dates.dt.month/ 12)
-    time_feats['Day'] = dates.dt.day
-    time_feats['DayofWeekSin'] = np.sin(2 * np.pi * dates.dt.dayofweek/ 7)
-    time_feats['DayofWeekCos'] = np.cos(2 * np.pi * dates.dt.dayofweek/ 7)
-    time_feats["WeekofYearSin"] = np.sin(2 * np.pi * dates.dt.isocalendar().week / 52)
-    time_feats["WeekofYearCos"] = np.cos(2 * np.pi * dates.dt.isocalendar().week / 52)
-    time_feats["QuarterSin"] = np.sin(2 * np.pi * dates.dt.quarter / 4)
-    time_feats["QuarterCos"] = np.cos(2 * np.pi * dates.dt.quarter / 4)
+    time_feats = lookup_calendar(dates)
     time_feats['TimeIndex'] = ((dates - dates.min()).dt.days) // 7  # A simple trend feature
 
     return time_feats
 
-def make_rolling(feat_df, window_sizes):
+def window_sums(cumulative, size):
+    ''' Sums of the windows of `size` values ending at each position, given the cumulative sums from 0 '''
+    return np.concatenate([np.full(size - 1, np.nan), cumulative[size:] - cumulative[:-size]])
+
+def window_extremes(values, window_sizes, reduce):
+    ''' np.minimum or np.maximum over the windows of each size ending at each position.
+
+    Level j holds the reduction of the 2**j values starting at each position, each level built from the previous
+    one, and a window is covered by the two overlapping power of two blocks at its start and end.
+    '''
+    levels = [values]
+    while 2 ** len(levels) <= max(window_sizes):
+        step = 2 ** (len(levels) - 1)
+        levels.append(reduce(levels[-1][:-step], levels[-1][step:]))
+    extremes = {}
     for size in window_sizes:
-        feat_df[f'rolling_{size}_mean'] = feat_df.groupby('Type')['AveragePrice_combined_lag_4'].transform(
-            lambda x: x.rolling(size).mean())
-        feat_df[f'rolling_{size}_mean'] = feat_df.groupby('Type')['AveragePrice_combined_lag_4'].transform(
-            lambda x: x.rolling(size).std())
-        feat_df[f'rolling_{size}_mean'] = feat_df.groupby('Type')['AveragePrice_combined_lag_4'].transform(
-            lambda x: x.rolling(size).max())
-        feat_df[f'rolling_{size}_mean'] = feat_df.groupby('Type')['AveragePrice_combined_lag_4'].transform(
-            lambda x: x.rolling(size).min())
-    return feat_df
+        width = 2 ** (size.bit_length() - 1)
+        level = levels[size.bit_length() - 1]
+        n_windows = len(values) - size + 1
+        extremes[size] = np.concatenate([
+            np.full(size - 1, np.nan), reduce(level[:n_windows], level[size - width:size - width + n_windows])])
+    return extremes
+
+def make_rolling(feat_df, window_sizes, group_keys='Type'):
+    ''' Rolling mean, std, min and max of ROLLING_COLUMN within each group, one column per window size and stat.
+
+    Rows are sorted by group and each stat is computed for all groups at once: mean and std from cumulative
+    sums, min and max from window_extremes. Windows reaching into the previous group are then dropped. As in
+    pandas, a window with a missing value is NaN.
+    '''
+    # Windows longer than the frame are never full
+    rolling = {f'rolling_{size}_{stat}': np.nan for size in window_sizes for stat in ROLLING_STATS}
+    computed_sizes = [size for size in window_sizes if size <= len(feat_df)]
+    if computed_sizes:
+        # Rows with a missing group key get NaN from ngroup, -1 here
+        group_ids = feat_df.groupby(group_keys, sort=False).ngroup().fillna(-1).to_numpy(dtype='int64')
+        order = np.argsort(group_ids, kind='stable')
+        sorted_ids = group_ids[order]
+        sorted_values = feat_df[ROLLING_COLUMN].to_numpy(dtype='float64')[order]
+
+        # Position of each sorted row within its group
+        group_starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(order)])
+        position = np.arange(len(order)) - np.repeat(group_starts, group_sizes)
+
+        missing = np.isnan(sorted_values)
+        # Centered, so the sums of squares do not cancel out in the variance
+        center = sorted_values[~missing].mean() if not missing.all() else 0.0
+        centered = np.where(missing, 0.0, sorted_values - center)
+        cumulative_sums = np.r_[0.0, np.cumsum(centered)]
+        cumulative_squares = np.r_[0.0, np.cumsum(centered ** 2)]
+        cumulative_missing = np.r_[0, np.cumsum(missing)]
+        minimums = window_extremes(sorted_values, computed_sizes, np.minimum)
+        maximums = window_extremes(sorted_values, computed_sizes, np.maximum)
+
+        for size in computed_sizes:
+            sums = window_sums(cumulative_sums, size)
+            if size > 1:
+                with np.errstate(invalid='ignore'):
+                    variance = np.maximum(window_sums(cumulative_squares, size) - sums * sums / size, 0) / (size - 1)
+            else:
+                # The sample std (ddof=1) of a single value is NaN, as in pandas
+                variance = np.full(len(sums), np.nan)
+            # Windows reaching into the previous group or holding a missing value, and rows without a group
+            incomplete = (
+                (position < size - 1) | (window_sums(cumulative_missing, size) != 0) | (sorted_ids < 0))
+            stats = {
+                'mean': center + sums / size,
+                'std': np.sqrt(variance),
+                'min': minimums[size],
+                'max': maximums[size],
+            }
+            for stat, sorted_stat in stats.items():
+                sorted_stat[incomplete] = np.nan
+                values = np.empty_like(sorted_stat)
+                values[order] = sorted_stat
+                rolling[f'rolling_{size}_{stat}'] = values
+    return pd.concat([feat_df, pd.DataFrame(rolling, index=feat_df.index)], axis=1)
 
 def make_stage_2_data(merge_df, region, configs):
     lags_df = make_target_region_lags_df(merge_df, region, configs)
@@ -101,4 +208,95 @@ def make_stage_2_data(merge_df, region, configs):
     
     y = feat_df[configs['target_name']]
     
-    return X, y, dates
\ No newline at end of file
+    return X, y, dates
+
+
+def make_time_features_all_regions(sorted_df):
+    ''' make_time_features for a frame holding several regions, TimeIndex counts from each region's first date '''
+    time_feats = make_time_features(sorted_df)
+    region_start = sorted_df.groupby('Region', sort=False)['Date'].transform('min')
+    time_feats['TimeIndex'] = ((sorted_df['Date'] - region_start).dt.days) // 7
+    return time_feats
+
+def make_aux_region_lags_all_regions(sorted_df, grouped, region_blocks, configs):
+    ''' Aux region lags placed on every row of the stacked frame.
+
+    The per region path concatenates the aux lags by position (both frames have a reset index), so the
+    i-th row of any region gets the i-th row of the aux region. The same gather is done here in one go.
+    '''
+    row_position = sorted_df.groupby('Region', sort=False).cumcount().to_numpy()
+    aux_lags = {}
+    for aux_region_name in configs['aux_regions']:
+        start, stop = region_blocks.get(aux_region_name, (0, 0))
+        for col_name in configs['aux_features']:
+            for lag in configs['aux_lags']:
+                shifted = grouped[col_name].shift(lag).to_numpy(dtype='float64')[start:stop]
+                padded = np.append(shifted, np.nan)
+                aux_lags[f'{aux_region_name}_{col_name}_lag_{lag}'] = padded[np.minimum(row_position, stop - start)]
+    return pd.DataFrame(aux_lags, index=sorted_df.index)
+
+def make_stage_2_data_all_regions(merge_df, regions, configs):
+    ''' Same output as make_stage_2_data for every region in `regions`, built in one pass.
+
+    Regions are stacked in contiguous blocks, so each returned (X, y, dates) is a row slice of the shared
+    frames instead of a copy, except where a region needs its own column set.
+    '''
+    target_name = configs['target_name']
+    aux_regions = configs['aux_regions'] or []
+    needed_regions = list(dict.fromkeys(list(regions) + list(aux_regions)))
+
+    sel_df = merge_df[merge_df['Region'].isin(needed_regions)]
+    # Stable sort keeps each region's rows in their original order, as select_region does
+    sorted_df = sel_df.sort_values('Region', kind='stable').reset_index(drop=True)
+    block_sizes = sorted_df.groupby('Region', sort=False).size()
+    block_stops = block_sizes.cumsum()
+    region_blocks = {
+        region: (int(stop - size), int(stop)) for region, size, stop in zip(block_sizes.index, block_sizes, block_stops)}
+
+    columns_to_lag = merge_df.loc[:, merge_df.columns != target_name].select_dtypes(include=['number']).columns
+    grouped = sorted_df.groupby(['Region', 'Type'], sort=False)
+    with profiling.stage('lags'):
+        lag_frames = [
+            grouped[columns_to_lag].shift(lag).add_suffix(f'_lag_{lag}') for lag in configs['lags']]
+    if aux_regions:
+        with profiling.stage('aux_lags'):
+            lag_frames.append(make_aux_region_lags_all_regions(sorted_df, grouped, region_blocks, configs))
+
+    feat_df = pd.concat([sorted_df[['Date', 'Region', 'Type', target_name]]] + lag_frames, axis=1)
+    with profiling.stage('time_features'):
+        feat_df = pd.concat([feat_df, make_time_features_all_regions(feat_df)], axis=1)
+    with profiling.stage('make_rolling'):
+        feat_df = make_rolling(feat_df, configs['rolling_window_sizes'], group_keys=['Region', 'Type'])
+    feat_df = pd.get_dummies(feat_df, columns=['Type'], prefix='Type')
+
+    feature_columns = feat_df.columns.difference(['Date', 'Region', target_name])
+    X_all = feat_df[feature_columns]
+    int_time_columns = X_all[['Year', 'Day', 'TimeIndex']].columns
+    dummy_columns = [col for col in feature_columns if col.startswith('Type_')]
+    aux_lengths = {name: stop - start for name, (start, stop) in region_blocks.items() if name in aux_regions}
+
+    region_data = {}
+    for region in regions:
+        if region not in region_blocks:
+            raise ValueError(f"Region '{region}' not found in the stage 1 data")
+        start, stop = region_blocks[region]
+        n_rows = stop - start
+        row_index = pd.RangeIndex(n_rows)
+
+        X = X_all.iloc[start:stop].set_axis(row_index, axis=0, copy=False)
+        drop_columns = [col for col in dummy_columns if not X[col].any()]
+        if region in aux_regions:
+            # A region is never its own aux region
+            drop_columns += [
+                f'{region}_{col_name}_lag_{lag}' for col_name in configs['aux_features'] for lag in configs['aux_lags']]
+        if drop_columns:
+            X = X.drop(columns=drop_columns)
+        if any(length > n_rows for name, length in aux_lengths.items() if name != region):
+            # make_stage_2_data sees the extra aux rows as NaT dates, which turns these columns to float
+            X = X.astype({col: 'float64' for col in int_time_columns})
+
+        y = feat_df[target_name].iloc[start:stop].set_axis(row_index, copy=False)
+        dates = feat_df['Date'].iloc[start:stop].set_axis(row_index, copy=False)
+        region_data[region] = (X, y, dates)
+
+    return region_data
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import data_processing
+import feature_eng
+import profiling
+
+# Config keys that change the stage 1 / stage 2 frames, target_regions only decides which files exist
+CACHE_CONFIG_KEYS = ['target_name', 'lags', 'aux_regions', 'aux_features', 'aux_lags', 'rolling_window_sizes']
+# Bump when the feature code changes its output, so stale entries stop matching
+CACHE_FORMAT_VERSION = 3
+STAGE_1_FILE = 'stage_1.arrow'
+STAGE_2_DIR = 'stage_2'
+DATE_COLUMN = '__date__'
+TARGET_COLUMN = '__target__'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(data_path, configs):
+    ''' Content address of the features: input file bytes plus the configs that shape them '''
+    relevant_configs = {key: configs.get(key) for key in CACHE_CONFIG_KEYS}
+    payload = json.dumps(
+        {'data': file_digest(data_path), 'configs': relevant_configs, 'version': CACHE_FORMAT_VERSION},
+        sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:24]
+
+
+def write_frame(df, path):
+    ''' Write a frame in the layout read_frame can map without copying: uncompressed, one chunk, NaN kept '''
+    table = pa.Table.from_pandas(df)
+    # from_pandas turns NaN into nulls, which to_pandas has to fill back in with a copy
+    for i, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type) and table.column(i).null_count:
+            table = table.set_column(i, field, pa.array(df[field.name].to_numpy()))
+    # Write next to the target and rename, so a concurrent reader never sees a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    feather.write_feather(table, tmp_path, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(tmp_path, path)
+
+
+def read_frame(path):
+    ''' Memory-map a frame written by write_frame. Numeric and date columns are read-only views of the mapped
+    file rather than copies, only bool and string columns are converted '''
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+
+
+def save_region_data(entry_dir, region, X, y, dates):
+    region_df = X.copy()
+    region_df[TARGET_COLUMN] = y.to_numpy()
+    region_df[DATE_COLUMN] = dates.to_numpy()
+    write_frame(region_df.reset_index(drop=True), os.path.join(entry_dir, STAGE_2_DIR, f'{region}.arrow'))
+
+
+def load_region_data(entry_dir, region, configs):
+    region_df = read_frame(os.path.join(entry_dir, STAGE_2_DIR, f'{region}.arrow'))
+    y = region_df.pop(TARGET_COLUMN).rename(configs['target_name'])
+    dates = region_df.pop(DATE_COLUMN).rename('Date')
+    return region_df, y, dates
+
+
+def entry_size(entry_dir):
+    total = 0
+    for root, _, files in os.walk(entry_dir):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+
+def evict_entries(cache_dir, max_bytes, keep=None):
+    ''' Drop least recently used entries until the cache fits in max_bytes, `keep` is never evicted '''
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, name)
+        if os.path.isdir(entry_dir):
+            entries.append((os.path.getmtime(entry_dir), entry_dir, entry_size(entry_dir)))
+
+    total = sum(size for _, _, size in entries)
+    for _, entry_dir, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.basename(entry_dir) == keep:
+            continue
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        print(f'Evicted feature cache entry: {entry_dir}')
+        total -= size
+
+
+def get_features(configs, data_path=data_processing.DATA_PATH, cache_dir=None, max_mb=None):
+    ''' Stage 1 frame and {region: (X, y, dates)} for configs['target_regions'], served from the cache when possible
+
+    Without a cache dir (argument or configs['feature_cache_dir']) everything is rebuilt as before.
+    '''
+    cache_dir = cache_dir or configs.get('feature_cache_dir')
+    regions = configs['target_regions']
+    if not cache_dir:
+        with profiling.stage('stage_1'):
+            merge_df = data_processing.make_stage_1_data(configs, data_path)
+        with profiling.stage('stage_2'):
+            return merge_df, feature_eng.make_stage_2_data_all_regions(merge_df, regions, configs)
+
+    key = cache_key(data_path, configs)
+    entry_dir = os.path.join(cache_dir, key)
+    os.makedirs(os.path.join(entry_dir, STAGE_2_DIR), exist_ok=True)
+
+    stage_1_path = os.path.join(entry_dir, STAGE_1_FILE)
+    if os.path.exists(stage_1_path):
+        with profiling.stage('stage_1_cache_read'):
+            merge_df = read_frame(stage_1_path)
+        print(f'Loaded stage 1 data from feature cache {key}')
+    else:
+        with profiling.stage('stage_1'):
+            merge_df = data_processing.make_stage_1_data(configs, data_path)
+            write_frame(merge_df, stage_1_path)
+
+    region_data = {}
+    missing_regions = []
+    with profiling.stage('stage_2_cache_read'):
+        for region in regions:
+            if os.path.exists(os.path.join(entry_dir, STAGE_2_DIR, f'{region}.arrow')):
+                region_data[region] = load_region_data(entry_dir, region, configs)
+            else:
+                missing_regions.append(region)
+    print(f'Feature cache {key}: {len(region_data)} regions cached, {len(missing_regions)} to build')
+
+    if missing_regions:
+        with profiling.stage('stage_2'):
+            built = feature_eng.make_stage_2_data_all_regions(merge_df, missing_regions, configs)
+            for region, (X, y, dates) in built.items():
+                save_region_data(entry_dir, region, X, y, dates)
+        region_data.update(built)
+
+    # mtime of the entry dir is the LRU clock
+    os.utime(entry_dir)
+    max_mb = max_mb if max_mb is not None else configs.get('feature_cache_max_mb', 1024)
+    evict_entries(cache_dir, max_mb * 1024 * 1024, keep=key)
+
+    return merge_df, {region: region_data[region] for region in regions}
@@ -0,0 +1,219 @@
+''' Incremental ingestion of weekly appended avocado data.
+
+Raw rows are read in chunks with compact dtypes (categorical Region and Type, float32 volumes) and kept
+that way. Stage 1 rows are built for blocks of whole weeks of about a chunk each, since the types of a week
+and region can sit in different chunks of the file (avocado.csv is ordered by type and region), and each
+block is appended to a columnar store as its own part file, with categorical keys. Stage 2 features are
+then computed for the new weeks from a short tail of the stored history (the longest lag plus the longest
+rolling window), read from the parts that reach it and filtered on Date before it is converted to pandas,
+so the cost of an ingestion follows the size of the new data instead of the full history.
+
+Volumes are kept as float32, so features match a full rebuild to float32 precision. Aux region lags are
+aligned by row position, as in feature_eng, which a region with missing weeks only reproduces within the
+recomputed tail.
+
+Usage: python ingestion.py <new_rows.csv>
+'''
+import json
+import os
+import sys
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+
+import data_processing
+import feature_eng
+
+RAW_DTYPES = {
+    'region': 'category',
+    'type': 'category',
+    'AveragePrice': 'float64',
+    'Total Volume': 'float32',
+    '4046': 'float32',
+    '4225': 'float32',
+    '4770': 'float32',
+    'Total Bags': 'float32',
+    'Small Bags': 'float32',
+    'Large Bags': 'float32',
+    'XLarge Bags': 'float32',
+    'year': 'int16',
+}
+METADATA_FILE = 'metadata.json'
+STAGE_1_DIR = 'stage_1'
+STAGE_2_DIR = 'stage_2'
+DATE_COLUMN = '__date__'
+TARGET_COLUMN = '__target__'
+TYPE_COLUMN = '__type__'
+
+
+def read_raw_chunks(path, chunksize=50_000):
+    ''' Preprocessed raw rows of a file in the avocado.csv schema, one compact chunk at a time '''
+    for chunk in pd.read_csv(path, dtype=RAW_DTYPES, chunksize=chunksize):
+        yield data_processing.preprocess_raw_data(chunk)
+
+
+def concat_chunks(chunks):
+    ''' Concatenate compact chunks, Region and Type stay categorical over the union of their categories '''
+    chunks = list(chunks)
+    for col in ['Region', 'Type']:
+        categories = union_categoricals([chunk[col] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[col] = chunk[col].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def week_blocks(raw_df, block_rows):
+    ''' Raw rows in blocks of whole weeks of about block_rows rows, in date order '''
+    rows_per_date = raw_df.groupby('Date').size()
+    block_of_date = (rows_per_date.cumsum() - rows_per_date) // block_rows
+    for _, block in raw_df.groupby(raw_df['Date'].map(block_of_date), sort=True):
+        yield block
+
+
+def make_stage_1_block(block, target_name):
+    ''' Stage 1 rows of a block of whole weeks, with the categorical keys of the raw rows '''
+    key_dtypes = {'Region': block['Region'].dtype, 'Type': block['Type'].dtype}
+    # The stage 1 functions pivot and merge on plain string keys
+    block = block.astype({'Region': str, 'Type': str})
+    stage_1 = data_processing.pivot_and_merge_numerical_columns(
+        block, data_processing.group_by_region(block), target_name)
+    return stage_1.astype(key_dtypes)
+
+
+def context_weeks(configs):
+    ''' Weeks of history before a new week that its lags and rolling windows can reach '''
+    max_lag = max(configs['lags'] + (configs['aux_lags'] if configs['aux_regions'] else []))
+    return max_lag + max(configs['rolling_window_sizes'], default=0)
+
+
+def load_metadata(store_dir):
+    path = os.path.join(store_dir, METADATA_FILE)
+    if not os.path.exists(path):
+        return {'parts': [], 'origins': {}}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_metadata(store_dir, metadata):
+    tmp_path = os.path.join(store_dir, f'{METADATA_FILE}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(metadata, file, indent=2)
+    os.replace(tmp_path, os.path.join(store_dir, METADATA_FILE))
+
+
+def read_parts(store_dir, parts, keys, since=None):
+    ''' Concatenate part files, a later part overrides the rows an earlier one had for the same keys.
+    With `since`, only the rows from that date on are converted to pandas '''
+    frames = []
+    for part in parts:
+        table = feather.read_table(os.path.join(store_dir, part['file']), memory_map=True)
+        if since is not None:
+            table = table.filter(pc.field('Date') >= pa.scalar(since, type=table.schema.field('Date').type))
+        frames.append(table.to_pandas())
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True).astype({'Region': str, 'Type': str}, errors='ignore')
+    return df.drop_duplicates(subset=keys, keep='last').sort_values(keys, kind='stable').reset_index(drop=True)
+
+
+def load_stage_1(store_dir, since=None, metadata=None):
+    ''' Stored stage 1 frame, only reading the parts that reach `since` when given '''
+    metadata = metadata or load_metadata(store_dir)
+    parts = [
+        part for part in metadata['parts']
+        if part['kind'] == STAGE_1_DIR and (since is None or pd.Timestamp(part['last_date']) >= since)]
+    return read_parts(store_dir, parts, ['Date', 'Region', 'Type'], since=since)
+
+
+def load_region_data(store_dir, region, configs):
+    ''' Stored (X, y, dates) of a region, in the layout feature_eng.make_stage_2_data returns '''
+    parts = [part for part in load_metadata(store_dir)['parts'] if part['kind'] == f'{STAGE_2_DIR}/{region}']
+    frames = [feather.read_table(os.path.join(store_dir, part['file']), memory_map=True).to_pandas() for part in parts]
+    region_df = pd.concat(frames, ignore_index=True)
+    region_df = region_df.drop_duplicates(subset=[DATE_COLUMN, TYPE_COLUMN], keep='last')
+    region_df = region_df.sort_values(DATE_COLUMN, kind='stable').reset_index(drop=True)
+    y = region_df.pop(TARGET_COLUMN).rename(configs['target_name'])
+    dates = region_df.pop(DATE_COLUMN).rename('Date')
+    region_df = region_df.drop(columns=TYPE_COLUMN)
+    return region_df, y, dates
+
+
+def load_features(configs, store_dir=None):
+    ''' Same return value as feature_store.get_features, read from the incremental store '''
+    store_dir = store_dir or configs['incremental_store_dir']
+    merge_df = load_stage_1(store_dir)
+    region_data = {region: load_region_data(store_dir, region, configs) for region in configs['target_regions']}
+    return merge_df, region_data
+
+
+def write_part(store_dir, metadata, kind, df):
+    os.makedirs(os.path.join(store_dir, kind), exist_ok=True)
+    file = os.path.join(kind, f'part-{len(metadata["parts"]):06d}.arrow')
+    feather.write_feather(df.reset_index(drop=True), os.path.join(store_dir, file), compression='uncompressed')
+    metadata['parts'].append({
+        'kind': kind,
+        'file': file,
+        'first_date': str(df['Date' if 'Date' in df else DATE_COLUMN].min().date()),
+        'last_date': str(df['Date' if 'Date' in df else DATE_COLUMN].max().date()),
+        'rows': len(df),
+    })
+
+
+def ingest(data_path, configs, store_dir=None, chunksize=None):
+    ''' Add the weeks of `data_path` to the store, rows of weeks already stored replace the stored ones.
+
+    Returns a summary with the ingested weeks and row counts.
+    '''
+    store_dir = store_dir or configs['incremental_store_dir']
+    chunksize = chunksize or configs.get('ingestion_chunksize', 50_000)
+    os.makedirs(store_dir, exist_ok=True)
+    metadata = load_metadata(store_dir)
+
+    raw_df = concat_chunks(read_raw_chunks(data_path, chunksize))
+    stage_1_rows = 0
+    for block in week_blocks(raw_df, chunksize):
+        new_stage_1 = make_stage_1_block(block, configs['target_name'])
+        write_part(store_dir, metadata, STAGE_1_DIR, new_stage_1)
+        stage_1_rows += len(new_stage_1)
+
+        # Region origins anchor TimeIndex, they only move if older weeks arrive
+        for region, first_date in new_stage_1.groupby('Region', observed=True)['Date'].min().items():
+            stored = metadata['origins'].get(region)
+            metadata['origins'][region] = (
+                str(min(pd.Timestamp(stored), first_date).date()) if stored else str(first_date.date()))
+
+    # Stage 2 for the new weeks only, from the stored history they can reach
+    first_new_date = raw_df['Date'].min()
+    tail_start = first_new_date - pd.Timedelta(weeks=context_weeks(configs))
+    tail_df = load_stage_1(store_dir, since=tail_start, metadata=metadata)
+    new_regions = set(raw_df['Region'].unique())
+    regions = [region for region in configs['target_regions'] if region in new_regions]
+    region_data = feature_eng.make_stage_2_data_all_regions(tail_df, regions, configs)
+    for region, (X, y, dates) in region_data.items():
+        new_rows = (dates >= first_new_date).to_numpy()
+        region_df = X[new_rows].copy()
+        region_df['TimeIndex'] = (dates[new_rows] - pd.Timestamp(metadata['origins'][region])).dt.days // 7
+        region_df[TARGET_COLUMN] = y[new_rows].to_numpy()
+        region_df[DATE_COLUMN] = dates[new_rows].to_numpy()
+        region_df[TYPE_COLUMN] = tail_df.loc[tail_df['Region'] == region, 'Type'].to_numpy()[new_rows]
+        write_part(store_dir, metadata, f'{STAGE_2_DIR}/{region}', region_df)
+
+    save_metadata(store_dir, metadata)
+    summary = {
+        'first_date': str(first_new_date.date()),
+        'last_date': str(raw_df['Date'].max().date()),
+        'raw_rows': len(raw_df),
+        'stage_1_rows': stage_1_rows,
+        'history_rows_read': len(tail_df),
+        'regions': len(region_data),
+    }
+    print(f'Ingested {summary}')
+    return summary
+
+
+if __name__ == '__main__':
+    import configs
+    ingest(sys.argv[1], configs.configs)
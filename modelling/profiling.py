@@ -0,0 +1,211 @@
+''' Timing, memory and profiler instrumentation for the training pipeline.
+
+Code marks its stages with `with profiling.stage('name', region=...)`. This costs nothing until a
+Profiler is started. Once one is, each stage records its wall time, the process CPU time (XGBoost and
+upload threads included) and the process RSS when it ends. With memory tracing on, it also records the
+peak of traced Python allocations (numpy and pandas buffers, not XGBoost's) while it ran. Nested stages
+are named by their path, e.g. 'stage_2/make_rolling'.
+
+A cProfile or a simple sampling profiler (collapsed stacks of the main thread, the input format of
+flamegraph tools) can be run around the whole pipeline.
+'''
+import collections
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+
+import psutil
+
+active = None
+
+
+def rss_mb():
+    return psutil.Process().memory_info().rss / 2**20
+
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+
+
+class SamplingProfiler:
+    ''' Samples the stack of one thread every `interval` seconds from a background thread '''
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.main_thread().ident
+        self.stacks = collections.Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as file:
+            for stack, count in self.stacks.most_common():
+                file.write(f'{stack} {count}\n')
+
+
+class Profiler:
+    ''' Collects stage records, see the module docstring '''
+
+    def __init__(self, trace_memory=False, profiler=None):
+        self.trace_memory = trace_memory
+        self.profiler_kind = profiler
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.profiler = None
+        self.start_wall = self.start_cpu = None
+
+    def start(self):
+        self.start_wall, self.start_cpu = time.perf_counter(), time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.profiler_kind == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif self.profiler_kind == 'sampling':
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+        elif self.profiler_kind:
+            raise ValueError(f"Unknown profiler '{self.profiler_kind}', expected 'cprofile' or 'sampling'")
+        return self
+
+    def stop(self):
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.disable()
+        elif self.profiler is not None:
+            self.profiler.stop()
+        if self.trace_memory:
+            tracemalloc.stop()
+
+    @contextlib.contextmanager
+    def stage(self, name, **labels):
+        stack = self.local.__dict__.setdefault('stack', [])
+        path = '/'.join([frame['name'] for frame in stack] + [name])
+        if self.trace_memory:
+            # Carry the peak so far to the enclosing stage before resetting it for this one
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        frame = {'name': name, 'peak': 0}
+        stack.append(frame)
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            record = {
+                'stage': path,
+                **labels,
+                'wall_seconds': time.perf_counter() - start_wall,
+                'cpu_seconds': time.process_time() - start_cpu,
+                'rss_mb': rss_mb(),
+            }
+            stack.pop()
+            if self.trace_memory:
+                peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+                record['peak_traced_mb'] = peak / 2**20
+                if stack:
+                    stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            with self.lock:
+                self.records.append(record)
+
+    def add_records(self, records):
+        with self.lock:
+            self.records.extend(records)
+
+    def take_records(self):
+        with self.lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        ''' Totals per stage and per region, plus every record '''
+        stages, regions = {}, {}
+        for record in self.records:
+            totals = stages.setdefault(record['stage'], {'count': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0})
+            totals['count'] += 1
+            totals['wall_seconds'] += record['wall_seconds']
+            totals['cpu_seconds'] += record['cpu_seconds']
+            if 'peak_traced_mb' in record:
+                totals['peak_traced_mb'] = max(totals.get('peak_traced_mb', 0.0), record['peak_traced_mb'])
+            if 'region' in record:
+                region_stages = regions.setdefault(record['region'], {})
+                region_stages[record['stage']] = region_stages.get(record['stage'], 0.0) + record['wall_seconds']
+        return {
+            'wall_seconds': time.perf_counter() - self.start_wall,
+            'cpu_seconds': time.process_time() - self.start_cpu,
+            'max_rss_mb': max_rss_mb(),
+            'stages': stages,
+            'regions': regions,
+            'records': self.records,
+        }
+
+    def write(self, output_dir):
+        ''' Write summary.json and the profiler output to output_dir, returns the written paths '''
+        os.makedirs(output_dir, exist_ok=True)
+        paths = [os.path.join(output_dir, 'summary.json')]
+        with open(paths[0], 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+        if isinstance(self.profiler, cProfile.Profile):
+            paths.append(os.path.join(output_dir, 'profile.prof'))
+            self.profiler.dump_stats(paths[-1])
+            stats_text = io.StringIO()
+            pstats.Stats(self.profiler, stream=stats_text).sort_stats('cumulative').print_stats(40)
+            paths.append(os.path.join(output_dir, 'profile.txt'))
+            with open(paths[-1], 'w') as file:
+                file.write(stats_text.getvalue())
+        elif self.profiler is not None:
+            paths.append(os.path.join(output_dir, 'stacks.txt'))
+            self.profiler.write(paths[-1])
+        return paths
+
+
+def stage(name, **labels):
+    ''' Stage of the active profiler, a no-op when none is started '''
+    if active is None:
+        return contextlib.nullcontext()
+    return active.stage(name, **labels)
+
+
+def start(trace_memory=False, profiler=None):
+    global active
+    active = Profiler(trace_memory, profiler).start()
+    return active
+
+
+def stop():
+    global active
+    profiler, active = active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def take_records():
+    ''' Records of the active profiler, emptied, for a worker process to send back to the parent '''
+    return active.take_records() if active is not None else []
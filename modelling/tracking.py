@@ -0,0 +1,144 @@
+''' Deferred MLflow logging for training runs.
+
+The fluent MLflow calls train_models used make one synchronous round trip to the tracking server each
+(params, every metric, the plot, the model and its registration). DeferredLogger only creates the run up
+front. Params, metrics and tags are buffered per run, and plots are rendered into memory buffers. When the
+run ends, everything is sent from a background thread pool: params, metrics and tags in as few log_batch
+calls as possible, then the artifacts, the model and its registration. Training continues meanwhile.
+
+Artifact repositories only upload files, so the upload task writes the buffers to a temporary folder just
+before uploading them.
+'''
+import io
+import os
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import mlflow
+from mlflow.entities import Metric, Param, RunTag
+from mlflow.models import Model
+from mlflow.utils.validation import MAX_ENTITIES_PER_BATCH, MAX_PARAMS_TAGS_PER_BATCH
+
+import profiling
+
+# A batch holds at most MAX_ENTITIES_PER_BATCH entities, at most MAX_PARAMS_TAGS_PER_BATCH params and as many tags
+METRICS_PER_BATCH = MAX_ENTITIES_PER_BATCH - 2 * MAX_PARAMS_TAGS_PER_BATCH
+
+
+class DeferredLogger:
+    ''' Buffers the logging of several runs and uploads each one in the background once it ends '''
+
+    def __init__(self, max_workers=4, client=None):
+        self.client = client or mlflow.MlflowClient()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='mlflow-upload')
+        self.runs = {}
+        self.futures = {}
+        self.lock = threading.Lock()
+
+    def start_run(self, experiment_id, run_name, tags=None):
+        ''' Create the run (the only synchronous call) and return its id '''
+        run = self.client.create_run(experiment_id, run_name=run_name, tags=tags)
+        run_id = run.info.run_id
+        with self.lock:
+            self.runs[run_id] = {
+                'name': run_name, 'artifact_uri': run.info.artifact_uri,
+                'params': {}, 'metrics': {}, 'tags': {}, 'artifacts': {}, 'model': None}
+        return run_id
+
+    def log_params(self, run_id, params):
+        self.runs[run_id]['params'].update(params)
+
+    def log_metrics(self, run_id, metrics):
+        timestamp = int(time.time() * 1000)
+        self.runs[run_id]['metrics'].update({key: (float(value), timestamp) for key, value in metrics.items()})
+
+    def set_tags(self, run_id, tags):
+        self.runs[run_id]['tags'].update(tags)
+
+    def log_figure(self, run_id, figure, artifact_file):
+        ''' Render a matplotlib figure (or pyplot) to an in-memory PNG, the caller can close it right after '''
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png')
+        self.runs[run_id]['artifacts'][artifact_file] = buffer.getvalue()
+
+    def log_model(self, run_id, model, artifact_path, input_example=None, registered_model_name=None,
+                  registered_model_tags=None):
+        ''' Save, upload and optionally register an XGBoost model when the run is flushed '''
+        self.runs[run_id]['model'] = {
+            'model': model, 'artifact_path': artifact_path, 'input_example': input_example,
+            'name': registered_model_name, 'tags': registered_model_tags}
+
+    def end_run(self, run_id):
+        ''' Hand the run to the upload threads, returns the future of its upload '''
+        with self.lock:
+            run = self.runs.pop(run_id)
+            future = self.executor.submit(self.upload_run, run_id, run)
+            self.futures[run_id] = future
+        return future
+
+    def fail_run(self, run_id):
+        ''' Drop what a run buffered and mark it failed, for a run whose training raised '''
+        with self.lock:
+            self.runs.pop(run_id, None)
+        self.client.set_terminated(run_id, status='FAILED')
+
+    def upload_run(self, run_id, run):
+        with profiling.stage('mlflow_upload', run=run['name']):
+            self.send_run(run_id, run)
+
+    def send_run(self, run_id, run):
+        params = [Param(key, str(value)) for key, value in run['params'].items()]
+        metrics = [Metric(key, value, timestamp, 0) for key, (value, timestamp) in run['metrics'].items()]
+        tags = [RunTag(key, str(value)) for key, value in run['tags'].items()]
+        # One call unless a run has more params, tags or metrics than a batch allows
+        n_batches = max(
+            -(-len(params) // MAX_PARAMS_TAGS_PER_BATCH), -(-len(tags) // MAX_PARAMS_TAGS_PER_BATCH),
+            -(-len(metrics) // METRICS_PER_BATCH), 1)
+        for batch in range(n_batches):
+            self.client.log_batch(
+                run_id,
+                metrics=metrics[batch * METRICS_PER_BATCH:(batch + 1) * METRICS_PER_BATCH],
+                params=params[batch * MAX_PARAMS_TAGS_PER_BATCH:(batch + 1) * MAX_PARAMS_TAGS_PER_BATCH],
+                tags=tags[batch * MAX_PARAMS_TAGS_PER_BATCH:(batch + 1) * MAX_PARAMS_TAGS_PER_BATCH])
+
+        with tempfile.TemporaryDirectory() as upload_dir:
+            for artifact_file, content in run['artifacts'].items():
+                with open(os.path.join(upload_dir, artifact_file), 'wb') as file:
+                    file.write(content)
+            if run['artifacts']:
+                self.client.log_artifacts(run_id, upload_dir)
+
+            model = run['model']
+            if model is not None:
+                model_dir = os.path.join(upload_dir, model['artifact_path'])
+                mlflow.xgboost.save_model(
+                    model['model'], model_dir, input_example=model['input_example'],
+                    mlflow_model=Model(run_id=run_id, artifact_path=model['artifact_path']))
+                self.client.log_artifacts(run_id, model_dir, model['artifact_path'])
+                if model['name']:
+                    model_uri = f"{run['artifact_uri']}/{model['artifact_path']}"
+                    mlflow.register_model(model_uri, name=model['name'], tags=model['tags'])
+
+        self.client.set_terminated(run_id)
+
+    def wait(self, run_ids=None):
+        ''' Wait for the uploads of the given (default: all ended) runs, returns {run id: traceback} of failures '''
+        with self.lock:
+            run_ids = list(self.futures) if run_ids is None else run_ids
+            pending = [(run_id, self.futures.pop(run_id)) for run_id in run_ids if run_id in self.futures]
+        failures = {}
+        for run_id, future in pending:
+            try:
+                future.result()
+            except Exception:
+                failures[run_id] = traceback.format_exc()
+                self.client.set_terminated(run_id, status='FAILED')
+        return failures
+
+    def close(self):
+        failures = self.wait()
+        self.executor.shutdown()
+        return failures
@@ -1,21 +1,30 @@
-import matplotlib.pyplot as plt
+''' Training entry point: python train_models.py
+
+MLflow, XGBoost (with scikit-learn), matplotlib, Optuna and the ingestion store are imported by the functions
+that use them rather than here. Importing this module is then cheap for the spawned training workers, which
+import it again, for the scripts that only use its helpers, and for a parent process that hands the fitting
+to its workers. See benchmarks/bench_import_time.py.
+'''
 import os
-import xgboost as xgb
-import mlflow
-import mlflow
-import mlflow.xgboost
-import xgboost as xgb
-from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
-from sklearn.model_selection import train_test_split
+import sys
 import time
-from sklearn.model_selection import train_test_split
 import json
+import numpy as np
+import pandas as pd
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import warnings
 from dotenv import load_dotenv
 import data_processing
 import feature_eng
+import feature_store
+import profiling
 import configs
 
+GLOBAL_MODEL_NAME = 'GLOBAL_AVOCADO_FORECAST'
+REGION_CODE_COLUMN = 'RegionCode'
+
 def convert_numbers(obj):
         for key, value in obj.items():
             if isinstance(value, str) and value.isdigit():
@@ -79,8 +88,17 @@ def load_configs():
     
     return configs.configs
 
+def pyplot():
+    ''' matplotlib.pyplot, imported on the first plot with the non-interactive Agg backend unless MPLBACKEND sets one '''
+    import matplotlib
+    if 'matplotlib.pyplot' not in sys.modules and not os.getenv('MPLBACKEND'):
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
 def plot_results(y_train, y_true, y_pred, target_name, dates, fold=None):
     # Plot the fold results
+    plt = pyplot()
     plt.figure(figsize=(12, 6))
     plt.plot(dates.loc[y_train.index], y_train, label='Train')
     plt.plot(dates.loc[y_true.index], y_true, label='True')
@@ -94,63 +112,329 @@ def plot_results(y_train, y_true, y_pred, target_name, dates, fold=None):
     plt.ylabel(target_name)
     return plt
 
+def split_cores(n_workers, n_regions, cpu_count=None):
+    ''' Number of worker processes and XGBoost n_jobs per process, so that workers * n_jobs <= cores '''
+    cpu_count = cpu_count or os.cpu_count() or 1
+    n_workers = n_workers or cpu_count
+    n_workers = max(1, min(n_workers, n_regions, cpu_count))
+    return n_workers, max(1, cpu_count // n_workers)
+
+def init_worker(tracking_uri, experiment_id, profile_memory=None):
+    import mlflow
+    # Each process keeps its own fluent MLflow state, so point it at the experiment the parent created
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment_id=experiment_id)
+    # Stage timings of a worker are sent back with each result, profile_memory is None when not profiling
+    if profile_memory is not None:
+        profiling.start(trace_memory=profile_memory)
+
+def train_region_in_worker(*args):
+    result = train_region(*args)
+    result['profile_records'] = profiling.take_records()
+    return result
+
+def train_region(region, X, y, dates, configs, experiment_id, n_jobs=None, logger=None):
+    ''' Fit, evaluate, log and register the model of a single region, returns its run summary
+
+    Logging goes through a tracking.DeferredLogger. With a shared `logger` the upload is left running for the
+    caller to wait on, otherwise a private one is waited on before returning.
+    '''
+    import xgboost as xgb
+    from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
+    from sklearn.model_selection import train_test_split
+    import tracking
+
+    start = time.perf_counter()
+    own_logger = logger is None
+    logger = logger or tracking.DeferredLogger()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
+
+    # Start one run per region
+    with profiling.stage('create_run', region=region):
+        run_id = logger.start_run(experiment_id, run_name=f"Region: {region}")
+
+    try:
+        # get best params from grid search
+        params = load_best_params(region, from_json=True)
+        logger.log_params(run_id, {"region": region, **params})
+        if n_jobs is not None:
+            params = {**params, 'n_jobs': n_jobs}
+
+        # Evaluate final model on the hold-out test set using training data only
+        with profiling.stage('fit_test', region=region):
+            final_model_cv = xgb.XGBRegressor(**params)
+            final_model_cv.fit(X_train, y_train)
+            y_test_pred = final_model_cv.predict(X_test)
+        test_mse = mean_squared_error(y_test, y_test_pred)
+        test_mape = mean_absolute_percentage_error(y_test, y_test_pred)
+        logger.log_metrics(run_id, {"test_mse": test_mse, "test_mape": test_mape})
+
+        if configs.get('log_plots', True):
+            with profiling.stage('plot', region=region):
+                plot = plot_results(y_train, y_test, y_test_pred, configs['target_name'], dates)
+                logger.log_figure(run_id, plot, "plot_test.png")
+                plot.close()
+
+        with profiling.stage('fit_final', region=region):
+            final_model = xgb.XGBRegressor(**params)
+            final_model.fit(X, y)
+
+        # Saved, uploaded and registered in the background
+        logger.log_model(
+            run_id, final_model, artifact_path="final_model", input_example=X.iloc[:1],
+            registered_model_name=f'{region}_AVOCADO_FORECAST', registered_model_tags={"region": region})
+    except Exception:
+        logger.fail_run(run_id)
+        raise
+    logger.end_run(run_id)
+
+    if own_logger:
+        with profiling.stage('mlflow_wait', region=region):
+            failures = logger.close()
+        if failures:
+            raise RuntimeError(f"Logging the run of region {region} failed:\n{failures[run_id]}")
+
+    return {
+        'region': region,
+        'run_id': run_id,
+        'test_mse': test_mse,
+        'test_mape': test_mape,
+        'seconds': time.perf_counter() - start,
+    }
+
+def train_all_regions(region_data, configs, experiment_id):
+    ''' Train every region, in a process pool when configs['n_workers'] != 1.
+
+    Returns (results, failures) where failures maps region to the formatted exception.
+    '''
+    import mlflow
+    import tracking
+
+    regions = list(region_data)
+    n_workers, n_jobs = split_cores(configs.get('n_workers', 1), len(regions))
+    results, failures = [], {}
+
+    if n_workers == 1:
+        # Uploads of a region overlap with training the next ones
+        logger = tracking.DeferredLogger(max_workers=configs.get('mlflow_upload_workers', 4))
+        for region in regions:
+            print(f'Trainning: {region}')
+            try:
+                results.append(train_region(region, *region_data[region], configs, experiment_id, logger=logger))
+            except Exception:
+                failures[region] = traceback.format_exc()
+        with profiling.stage('mlflow_wait'):
+            upload_failures = logger.close()
+        failed_regions = {result['run_id']: result['region'] for result in results if result['run_id'] in upload_failures}
+        for run_id, region in failed_regions.items():
+            failures[region] = upload_failures[run_id]
+        return [result for result in results if result['run_id'] not in failed_regions], failures
+
+    print(f'Trainning {len(regions)} regions with {n_workers} workers x {n_jobs} XGBoost threads')
+    profile_memory = profiling.active.trace_memory if profiling.active is not None else None
+    with ProcessPoolExecutor(
+            max_workers=n_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(mlflow.get_tracking_uri(), experiment_id, profile_memory)) as executor:
+        futures = {
+            executor.submit(train_region_in_worker, region, *region_data[region], configs, experiment_id, n_jobs): region
+            for region in regions}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                result = future.result()
+                if profiling.active is not None:
+                    profiling.active.add_records(result['profile_records'])
+                results.append(result)
+                print(f'Trained: {region}')
+            except Exception:
+                failures[region] = traceback.format_exc()
+    return results, failures
+
+def print_training_report(results, failures, wall_seconds, n_workers=1):
+    ''' Per region times and test MAPE. With several workers, also the sum of the per region times over
+    the wall time: how many regions trained at once on average, not a speed-up measured against a serial run
+    (regions sharing the cores train slower than alone).
+    '''
+    for result in sorted(results, key=lambda result: result['region']):
+        print(f"{result['region']:<22} {result['seconds']:7.2f}s  test_mape={result['test_mape']:.4f}")
+    for region, error in failures.items():
+        print(f'FAILED {region}:\n{error}')
+    if not results:
+        return
+    summary = f"Trained {len(results)} regions ({len(failures)} failed) in {wall_seconds:.2f}s"
+    if n_workers > 1 and wall_seconds > 0:
+        region_seconds = sum(result['seconds'] for result in results)
+        summary += (f" with {n_workers} workers, sum of per region times {region_seconds:.2f}s, "
+                    f"sum of per region times / wall time {region_seconds / wall_seconds:.2f}")
+    print(summary)
+
+def stack_regions(region_data):
+    ''' All regions in one frame, with the region as an integer coded categorical column.
+
+    Columns are the union over regions (a region has no aux columns of its own, those stay NaN).
+    Returns X, y and the row positions of each region.
+    '''
+    frames, targets, region_rows, offset = [], [], {}, 0
+    for code, (region, (X, y, _)) in enumerate(region_data.items()):
+        frames.append(X.assign(**{REGION_CODE_COLUMN: np.int32(code)}))
+        targets.append(y)
+        region_rows[region] = np.arange(offset, offset + len(X))
+        offset += len(X)
+    X_all = pd.concat(frames, ignore_index=True)
+    # A region without a type has no dummy column for it, which is a False there and not a missing value
+    type_columns = [col for col in X_all.columns if col.startswith('Type_')]
+    X_all[type_columns] = X_all[type_columns].fillna(False).astype(bool)
+    columns = sorted(set(X_all.columns) - {REGION_CODE_COLUMN}) + [REGION_CODE_COLUMN]
+    return X_all[columns], pd.concat(targets, ignore_index=True), region_rows
+
+def train_global_model(region_data, configs, experiment_id):
+    ''' Fit, evaluate, log and register one model for all regions, returns per region run summaries
+
+    Logging goes through a tracking.DeferredLogger, as for the per region models, and is waited on before returning.
+    '''
+    import xgboost as xgb
+    from sklearn.metrics import mean_squared_error, mean_absolute_percentage_error
+    from sklearn.model_selection import train_test_split
+    import tracking
+
+    start = time.perf_counter()
+    regions = list(region_data)
+    X, y, region_rows = stack_regions(region_data)
+    # Same chronological 80/20 split as the per region models, taken inside each region
+    train_rows, test_rows = [], {}
+    for region, rows in region_rows.items():
+        region_train, region_test = train_test_split(rows, test_size=0.2, shuffle=False)
+        train_rows.append(region_train)
+        test_rows[region] = region_test
+    train_rows = np.concatenate(train_rows)
+
+    params = {
+        **configs.get('global_model_params', {}),
+        'enable_categorical': True,
+        'tree_method': 'hist',
+        'feature_types': ['c' if col == REGION_CODE_COLUMN else 'q' for col in X.columns],
+    }
+    logger = tracking.DeferredLogger(max_workers=configs.get('mlflow_upload_workers', 4))
+    with profiling.stage('create_run'):
+        run_id = logger.start_run(experiment_id, run_name="Region: global")
+
+    try:
+        logger.log_params(run_id, {"regions": json.dumps(regions), **configs.get('global_model_params', {})})
+
+        with profiling.stage('fit_test'):
+            final_model_cv = xgb.XGBRegressor(**params)
+            final_model_cv.fit(X.iloc[train_rows], y.iloc[train_rows])
+        results = []
+        for region, rows in test_rows.items():
+            y_test = y.iloc[rows]
+            y_test_pred = final_model_cv.predict(X.iloc[rows])
+            results.append({
+                'region': region,
+                'run_id': run_id,
+                'test_mse': mean_squared_error(y_test, y_test_pred),
+                'test_mape': mean_absolute_percentage_error(y_test, y_test_pred),
+            })
+        logger.log_metrics(run_id, {
+            **{f"test_mape_{result['region']}": result['test_mape'] for result in results},
+            "test_mape": np.mean([result['test_mape'] for result in results])})
+
+        with profiling.stage('fit_final'):
+            final_model = xgb.XGBRegressor(**params)
+            final_model.fit(X, y)
+
+        # Registered in the background, the API serves every region in the tag with it
+        logger.log_model(
+            run_id, final_model, artifact_path="final_model", input_example=X.iloc[:1],
+            registered_model_name=GLOBAL_MODEL_NAME,
+            registered_model_tags={"regions": json.dumps(regions), "region_code_column": REGION_CODE_COLUMN})
+    except Exception:
+        logger.fail_run(run_id)
+        raise
+    logger.end_run(run_id)
+
+    with profiling.stage('mlflow_wait'):
+        upload_failures = logger.close()
+    if upload_failures:
+        raise RuntimeError(f"Logging the run of the global model failed:\n{upload_failures[run_id]}")
+
+    seconds = time.perf_counter() - start
+    print(f"Trained global model on {len(regions)} regions in {seconds:.2f}s, "
+          f"mean test_mape={np.mean([result['test_mape'] for result in results]):.4f}")
+    for result in results:
+        result['seconds'] = seconds / len(results)
+    return results, {}
+
+def log_profile(profiler, configs):
+    ''' Write the profile summary (and profiler output) to configs['profile_dir'] and log it as its own MLflow run '''
+    import mlflow
+
+    output_dir = os.path.join(configs.get('profile_dir') or 'profiles', time.strftime('%Y%m%d-%H%M%S'))
+    paths = profiler.write(output_dir)
+    summary = profiler.summary()
+    with mlflow.start_run(run_name="Training profile"):
+        mlflow.log_params({key: configs.get(key) for key in ['profile_memory', 'profiler', 'n_workers', 'training_mode']})
+        metrics = {'profile_wall_seconds': summary['wall_seconds'], 'profile_max_rss_mb': summary['max_rss_mb']}
+        for stage, totals in summary['stages'].items():
+            metrics[f'profile_{stage}_wall_seconds'] = totals['wall_seconds']
+            if 'peak_traced_mb' in totals:
+                metrics[f'profile_{stage}_peak_traced_mb'] = totals['peak_traced_mb']
+        mlflow.log_metrics(metrics)
+        for path in paths:
+            mlflow.log_artifact(path, artifact_path='profile')
+    print(f'Profile written to {output_dir}')
+
 def main(experiment_name = os.getenv("EXPERIMENT_NAME")):
+    import mlflow
+
     mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))  # Set this if using a tracking server
 
     configs = load_configs()
     print('loaded configs')
-    merge_df = data_processing.make_stage_1_data(configs)
+    if configs.get('profile'):
+        profiling.start(trace_memory=configs.get('profile_memory', False), profiler=configs.get('profiler'))
+    with profiling.stage('load_features'):
+        if configs.get('incremental_store_dir'):
+            import ingestion
+            merge_df, region_data = ingestion.load_features(configs)
+        else:
+            merge_df, region_data = feature_store.get_features(configs)
     print('Loaded data')
     print(os.getenv("MLFLOW_TRACKING_URI"))
     print(os.getenv("AAA"))
-    mlflow.set_experiment(experiment_name)
+    experiment = mlflow.set_experiment(experiment_name)
     print('Set experiment name')
-    for region in configs['target_regions']:
-        print(f'Trainning: {region}')
-        X, y, dates = feature_eng.make_stage_2_data(merge_df, region, configs)
-        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
-        
-        # Start one run per region
-        with mlflow.start_run(run_name=f"Region: {region}") as region_run:
-            mlflow.log_param("region", region)
-
-            # get best params from grid search
-            params = load_best_params(region, from_json=True)
-            mlflow.log_params(params)
-
-            # Evaluate final model on the hold-out test set using training data only
-            final_model_cv = xgb.XGBRegressor(**params)
-            final_model_cv.fit(X_train, y_train)
-            y_test_pred = final_model_cv.predict(X_test)
-            test_mse = mean_squared_error(y_test, y_test_pred)
-            test_mape = mean_absolute_percentage_error(y_test, y_test_pred)
-            mlflow.log_metric("test_mse", test_mse)
-            mlflow.log_metric("test_mape", test_mape)
-            
-            plot = plot_results(y_train, y_test, y_test_pred, configs['target_name'], dates)
-            plot_path = f"plot_test.png"
-            plot.savefig(plot_path)
-            mlflow.log_artifact(plot_path)
-            plot.close()
-            # Delete the plot file after logging it
-            if os.path.exists(plot_path):
-                os.remove(plot_path)
-            
-            final_model = xgb.XGBRegressor(**params)
-            final_model.fit(X, y)
 
-            mlflow.xgboost.log_model(final_model, artifact_path="final_model", input_example=X.iloc[:1])
-            
-            # Register the model
-            model_uri = mlflow.get_artifact_uri("final_model")
-            tags = {"region": region}
-            mlflow.register_model(model_uri, name=f'{region}_AVOCADO_FORECAST', tags=tags)
+    if configs.get('tune_params') and configs.get('training_mode', 'per_region') == 'per_region':
+        import tuning
+        with profiling.stage('tuning'):
+            tuning.tune_regions(region_data, configs)
+        print('Tuned params')
+
+    start = time.perf_counter()
+    with profiling.stage('training'):
+        if configs.get('training_mode', 'per_region') == 'global':
+            n_workers = 1
+            results, failures = train_global_model(region_data, configs, experiment.experiment_id)
+        else:
+            n_workers, _ = split_cores(configs.get('n_workers', 1), len(region_data))
+            results, failures = train_all_regions(region_data, configs, experiment.experiment_id)
+    print_training_report(results, failures, time.perf_counter() - start, n_workers)
+
+    profiler = profiling.stop()
+    if profiler is not None:
+        log_profile(profiler, configs)
+    return results, failures
 
 if __name__ =='__main__':
     load_dotenv()
-    start = time.time()
+    start = time.perf_counter()
     print('START!')
-    main()
-    end = time.time()
-    elapsed_time = start - end
-    print(f"Elapsed time for main training function: {elapsed_time:.2f} seconds")
\ No newline at end of file
+    results, failures = main()
+    elapsed_time = time.perf_counter() - start
+    print(f"Elapsed time for main training function: {elapsed_time:.2f} seconds")
+    # The regions that trained are registered, but a failed region (or none trained) fails the job
+    if failures or not results:
+        print(f"Training failed for {len(failures)} of {len(results) + len(failures)} regions: {sorted(failures)}")
+        sys.exit(1)
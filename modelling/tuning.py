@@ -0,0 +1,136 @@
+''' Hyperparameter search for the per region models, writing the winners to region_best_params.json.
+
+Each region is tuned on the training part of its data only (the first 80%, as train_models holds out the
+rest for test_mape), with expanding window time series folds. The fold DMatrices are built once per region
+and shared by every trial, each trial early stops on the validation MAPE and is pruned by successive halving
+after each fold, and trials run in parallel threads.
+
+Usage: python tuning.py [region ...]
+'''
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import optuna
+import xgboost as xgb
+from sklearn.model_selection import TimeSeriesSplit, train_test_split
+
+PARAMS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'region_best_params.json')
+
+
+def suggest_params(trial):
+    ''' Search space of the parameters stored in region_best_params.json, n_estimators comes from early stopping '''
+    return {
+        'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3, log=True),
+        'max_depth': trial.suggest_int('max_depth', 3, 8),
+        'subsample': trial.suggest_float('subsample', 0.5, 1.0),
+        'colsample_bytree': trial.suggest_float('colsample_bytree', 0.5, 1.0),
+        'reg_lambda': trial.suggest_float('reg_lambda', 1e-3, 5.0, log=True),
+        'reg_alpha': trial.suggest_float('reg_alpha', 1e-3, 2.5, log=True),
+        'gamma': trial.suggest_float('gamma', 1e-3, 0.6, log=True),
+    }
+
+
+def make_folds(X, y, n_splits):
+    ''' (train, validation) DMatrix pairs of the expanding window folds, sliced from one DMatrix '''
+    dtrain = xgb.DMatrix(X, label=y, enable_categorical=True)
+    return [
+        (dtrain.slice(train_rows), dtrain.slice(valid_rows))
+        for train_rows, valid_rows in TimeSeriesSplit(n_splits=n_splits).split(X)]
+
+
+def make_objective(folds, configs, nthread):
+    def objective(trial):
+        params = {
+            **suggest_params(trial),
+            'objective': 'reg:squarederror',
+            'eval_metric': 'mape',
+            'tree_method': 'hist',
+            'nthread': nthread,
+        }
+        scores, best_rounds = [], []
+        for step, (dtrain, dvalid) in enumerate(folds):
+            booster = xgb.train(
+                params, dtrain,
+                num_boost_round=configs.get('tuning_max_rounds', 500),
+                evals=[(dvalid, 'valid')],
+                early_stopping_rounds=configs.get('tuning_early_stopping_rounds', 20),
+                verbose_eval=False)
+            scores.append(booster.best_score)
+            best_rounds.append(booster.best_iteration + 1)
+            trial.report(float(np.mean(scores)), step)
+            if trial.should_prune():
+                raise optuna.TrialPruned()
+        trial.set_user_attr('n_estimators', int(np.mean(best_rounds)))
+        return float(np.mean(scores))
+    return objective
+
+
+def tune_region(region, X, y, configs, current_params=None):
+    ''' Best params of a region, as region_best_params.json stores them, and its study '''
+    X_train, _, y_train, _ = train_test_split(X, y, test_size=0.2, shuffle=False)
+    folds = make_folds(X_train, y_train, configs.get('tuning_n_splits', 4))
+    n_jobs = configs.get('tuning_n_jobs') or os.cpu_count() or 1
+
+    study = optuna.create_study(
+        direction='minimize',
+        sampler=optuna.samplers.TPESampler(seed=configs.get('tuning_seed', 0)),
+        pruner=optuna.pruners.SuccessiveHalvingPruner())
+    if current_params:
+        # Start from the stored params, so a new search never ends worse than them on the folds
+        study.enqueue_trial({
+            name: int(value) if name == 'max_depth' else float(value)
+            for name, value in current_params.items() if name != 'n_estimators'})
+    study.optimize(
+        make_objective(folds, configs, nthread=max(1, (os.cpu_count() or 1) // n_jobs)),
+        n_trials=configs.get('tuning_n_trials', 50),
+        timeout=configs.get('tuning_timeout_seconds'),
+        n_jobs=n_jobs)
+    best_params = {**study.best_params, 'n_estimators': study.best_trial.user_attrs['n_estimators']}
+    return best_params, study
+
+
+def load_params(path=PARAMS_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_best_params(best_params, path=PARAMS_PATH):
+    ''' Merge {region: params} into the params file, values as strings like the rest of the file '''
+    all_params = load_params(path)
+    for region, params in best_params.items():
+        all_params[region] = {name: str(value) for name, value in params.items()}
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(all_params, file, indent=4)
+    os.replace(tmp_path, path)
+
+
+def tune_regions(region_data, configs, path=PARAMS_PATH):
+    ''' Tune every region of {region: (X, y, dates)} and write the winners to the params file '''
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    stored_params = load_params(path)
+    best_params = {}
+    for region, (X, y, _) in region_data.items():
+        start = time.perf_counter()
+        best_params[region], study = tune_region(region, X, y, configs, stored_params.get(region))
+        pruned = sum(trial.state == optuna.trial.TrialState.PRUNED for trial in study.trials)
+        print(f'Tuned {region} in {time.perf_counter() - start:.2f}s: cv_mape={study.best_value:.4f} '
+              f'({len(study.trials)} trials, {pruned} pruned)')
+    save_best_params(best_params, path)
+    return best_params
+
+
+if __name__ == '__main__':
+    import configs
+    import feature_store
+
+    tuning_configs = dict(configs.configs)
+    if sys.argv[1:]:
+        tuning_configs['target_regions'] = sys.argv[1:]
+    _, region_data = feature_store.get_features(tuning_configs)
+    tune_regions(region_data, tuning_configs)
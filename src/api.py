@@ -1,28 +1,43 @@
-import mlflow
+"""
+FastAPI application serving the registered avocado price models.
+
+MLflow is imported by the functions that read the registry and load models, not at import time, so importing
+the app (gunicorn, the benchmarks, tools that only need the validation code) does not pay for it.
+"""
 import pandas as pd
-from fastapi import FastAPI, HTTPException, Depends, Path, Body
+from fastapi import FastAPI, HTTPException, Depends, Path, Body, Response
 from pydantic import create_model
-from mlflow.models import Model
 import datetime as dt
+import json
 import numpy as np
 from typing import Dict, List
 from dotenv import load_dotenv
+import gc
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
 from contextlib import asynccontextmanager
-
-def make_input_schema(model_uri, model_name):
+from starlette.concurrency import run_in_threadpool
+from src import artifacts
+from src import batching
+from src import caching
+from src import features
+from src import metrics
+from src import validation
+
+def make_input_schema(signature, model_name, exclude=()):
     """
     Create a Pydantic model for input data validation based on the MLflow model schema.
 
     Args:
-        model_uri (str): The URI of the MLflow model.
+        signature (mlflow.models.ModelSignature): The signature logged with the MLflow model.
         model_name (str): The name of the model.
+        exclude (tuple): Input columns the client does not send, such as the region code of a global model.
 
     Returns:
         pydantic.BaseModel: A Pydantic model for input data validation.
     """
-    mlflow_model = Model.load(model_uri)
-    signature = mlflow_model.signature
 
     if signature and signature.inputs:
         input_schema = signature.inputs.to_dict() 
@@ -47,84 +62,592 @@ def make_input_schema(model_uri, model_name):
     fields = {}
     for col in input_schema:
         col_name = col.get("name")
+        if col_name in exclude:
+            continue
         mlflow_type = col.get("type", "string").lower()
         py_type = type_mapping.get(mlflow_type, str)
         fields[col_name] = (py_type, ...)
 
     return create_model(f"schema_{model_name}", **fields)
 
-def load_all_models():
+def list_registered_models(client):
+    """
+    Read the registry listing: the latest version of every registered model that has a region tag.
+    A global model, tagged with the list of regions it was trained on, gets an entry for each of them,
+    with the region code it knows the region by.
+
+    Args:
+        client (mlflow.MlflowClient): The MLflow client.
+
+    Returns:
+        dict: A dictionary with region as keys and model name, version, run id and uri as values.
+    """
+    registered_regions = {}
+    for registered_model in client.search_registered_models():
+        model_name = registered_model.name
+        if not registered_model.latest_versions:
+            print(f"Warning: Model '{model_name}' has no versions. Skipping...")
+            continue
+        # The listing already carries the latest version of each stage with its tags
+        latest_version_info = max(registered_model.latest_versions, key=lambda version: int(version.version))
+        model_info = {
+            'model_name': model_name,
+            'version': int(latest_version_info.version),
+            'uri': latest_version_info.source,
+            'run_id': latest_version_info.run_id,
+            'loaded': False,
+        }
+        region = latest_version_info.tags.get('region')
+        if region:
+            registered_regions[region] = model_info
+        elif latest_version_info.tags.get('regions'):
+            region_code_column = latest_version_info.tags.get('region_code_column', 'RegionCode')
+            for region_code, region in enumerate(json.loads(latest_version_info.tags['regions'])):
+                # A region with its own model keeps it
+                registered_regions.setdefault(region, {
+                    **model_info, 'region': region, 'region_code': region_code,
+                    'region_code_column': region_code_column})
+        else:
+            print(f"Warning: Model '{model_name}' has no 'region' tag. Skipping...")
+    return registered_regions
+
+
+def load_model_entry(model_info: dict):
+    """
+    Download a registered model once and build its serving entry: model, input schema and feature order.
+    The regions of a global model share the model, it is only loaded for the first of them. A region the
+    global model also uses as an aux region gets its own schema without its aux columns, see region_aux_columns.
+
+    Args:
+        model_info (dict): Model name, version and uri, as returned by list_registered_models.
+
+    Returns:
+        dict: The model details, ready to serve.
+    """
+    if 'region_code' not in model_info:
+        return load_single_model_entry(model_info)
+
+    key = (model_info['model_name'], model_info['version'])
+    with shared_models_lock:
+        shared_lock = shared_model_locks.setdefault(key, threading.Lock())
+    with shared_lock:
+        if key not in shared_models:
+            shared_models[key] = load_single_model_entry(model_info)
+            # Only the latest version of a global model is kept
+            for old_key in [old_key for old_key in shared_models if old_key[0] == key[0] and old_key != key]:
+                del shared_models[old_key]
+    model_entry = {**shared_models[key], **model_info, 'loaded': True}
+    aux_columns = region_aux_columns(model_entry)
+    if aux_columns:
+        model_entry.update(make_validation(
+            model_entry['signature'], model_info['model_name'], (model_info['region_code_column'], *aux_columns),
+            native='booster' in model_entry))
+    return model_entry
+
+
+def region_aux_columns(model_entry: dict):
+    """
+    The aux lag columns of a global model that belong to the region itself. Aux lags are named
+    <aux region>_<feature>_lag_<lag> and a region is never its own aux region, so these were NaN for the
+    region in training. The client cannot send them (JSON has no NaN), they are left out of its schema
+    and predicted as missing.
+
+    Args:
+        model_entry (dict): The entry of a region of a global model.
+
+    Returns:
+        tuple: The names of the region's own aux columns, empty for a region that is not an aux region.
+    """
+    prefix = f"{model_entry['region']}_"
+    return tuple(name for name in model_entry['feature_names'] if name.startswith(prefix))
+
+
+def make_validation(signature, model_name: str, exclude: tuple, native: bool):
+    """
+    Build the input schema of a model and compile its validator, see make_input_schema.
+
+    Args:
+        signature (mlflow.models.ModelSignature): The signature logged with the MLflow model.
+        model_name (str): The name of the model.
+        exclude (tuple): Input columns the client does not send, left as NaN by the validator.
+        native (bool): Whether the model is served by the native booster.
+
+    Returns:
+        dict: The input schema and the validator, to update the model entry with.
+    """
+    input_schema = make_input_schema(signature, model_name, exclude)
+    return {
+        'input_schema': input_schema,
+        # Validates straight into the array the booster predicts on, float32, or the float64 the frame is built from
+        'validator': validation.BatchValidator(
+            signature.inputs.to_dict(), input_schema, exclude, dtype=np.float32 if native else np.float64),
+    }
+
+
+def load_single_model_entry(model_info: dict):
+    """
+    Download a model and build its serving entry, see load_model_entry. The input validator of the model
+    is compiled here, once, from its signature.
+
+    Args:
+        model_info (dict): Model name, version and uri, as returned by list_registered_models.
+
+    Returns:
+        dict: The model details, ready to serve.
+    """
+    import mlflow.pyfunc
+    import mlflow.xgboost
+    from mlflow.models import Model
+
+    start = time.perf_counter()
+    # Downloaded once per host into MODEL_CACHE_DIR when it is set, the workers of the host share the files
+    local_path = artifacts.download_model(model_info, os.getenv("MODEL_CACHE_DIR"))
+    signature = Model.load(local_path).signature
+    # The region code of a global model comes from the request path, not from the client
+    exclude = (model_info['region_code_column'],) if 'region_code' in model_info else ()
+    # "native" serves XGBoost boosters directly, skipping pandas and the pyfunc schema enforcement
+    native = os.getenv("SERVING_MODE", "pyfunc").lower() == 'native'
+    model_entry = {
+        **model_info,
+        'signature': signature,
+        'feature_names': signature.inputs.input_names(),
+        **make_validation(signature, model_info['model_name'], exclude, native),
+    }
+    if native:
+        model_entry['booster'] = mlflow.xgboost.load_model(local_path).get_booster()
+    else:
+        model_entry['loaded_model'] = mlflow.pyfunc.load_model(local_path)
+    model_entry['loaded'] = True
+    model_entry['load_seconds'] = time.perf_counter() - start
+    # Size of the model files, a proxy for the memory the loaded model takes
+    model_entry['model_bytes'] = sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(local_path) for name in names)
+    metrics.model_load_seconds.labels(model_info['model_name']).set(model_entry['load_seconds'])
+    print(f"Loaded model '{model_info['model_name']}' v{model_info['version']} in {model_entry['load_seconds']:.2f}s")
+    return model_entry
+
+
+async def get_model_table():
+    """
+    Snapshot of the model table for one request. Reloads publish a new table instead of editing this one,
+    so everything a request does (validation, prediction) sees a single model version.
+    Async, like the other dependencies of /predict/{region}, so resolving it does not take a thread pool slot.
+
+    Returns:
+        dict: A dictionary with region as keys and model details as values.
+    """
+    return all_region_models
+
+
+def get_model_entry(region: str, region_models: dict = None):
+    """
+    Return the serving entry of a region, loading the model first if it was left for its first request.
+
+    Args:
+        region (str): The region of the model.
+        region_models (dict): The model table to read, defaults to the current one.
+
+    Returns:
+        dict: The model details, or None if no model is registered for the region.
+    """
+    region_models = all_region_models if region_models is None else region_models
+    model_entry = region_models.get(region)
+    if model_entry is None or model_entry['loaded']:
+        return model_entry
+
+    with model_load_locks.setdefault(region, threading.Lock()):
+        model_entry = region_models[region]
+        if not model_entry['loaded']:
+            try:
+                # A load started at startup but over the budget is awaited instead of started again
+                pending = model_entry.get('pending')
+                if pending is not None and not pending.cancelled():
+                    model_entry = pending.result()
+                else:
+                    model_entry = load_model_entry(model_entry)
+            except Exception as e:
+                raise HTTPException(status_code=503, detail=f"Model for region '{region}' could not be loaded: {e}")
+            region_models[region] = model_entry
+    return model_entry
+
+
+async def get_region_model(region: str = Path(...), region_models: dict = Depends(get_model_table)):
+    """
+    Dependency resolving the model entry of the requested region once per request.
+    Only a model left for its first request is loaded in the thread pool, loaded entries are returned right away.
+
+    Args:
+        region (str): The region of the model.
+        region_models (dict): The model table snapshot of the request.
+
+    Returns:
+        dict: The model details, or None if no model is registered for the region.
+    """
+    model_entry = region_models.get(region)
+    if model_entry is None or model_entry['loaded']:
+        return model_entry
+    return await run_in_threadpool(get_model_entry, region, region_models)
+
+
+def load_all_models(use_budget: bool = True):
     """
     Load all registered models from MLflow and store them in a global dictionary.
 
+    MODEL_LOADING=lazy only reads the registry listing and loads each model on its first request.
+    Otherwise models are loaded concurrently by MODEL_LOAD_WORKERS threads, and any model not loaded
+    within MODEL_LOAD_BUDGET_SECONDS is left to load on its first request.
+
+    Args:
+        use_budget (bool): Whether to apply MODEL_LOAD_BUDGET_SECONDS, False to wait for every model.
+
     Returns:
         dict: A dictionary with region as keys and model details as values.
     """
-    all_region_models_dict = {}
+    import mlflow
+
+    start = time.perf_counter()
+    # Read before the registry, so a reload another worker finishes meanwhile is not taken as seen
+    cache_dir = os.getenv("MODEL_CACHE_DIR")
+    reload_generation = artifacts.reload_generation(cache_dir) if cache_dir else 0
     client = mlflow.MlflowClient()
-    
-    registered_models = client.search_registered_models()
-    
-    for registered_model in registered_models:
-        try:
-            print('LOADING MODEL')
-            model_name = registered_model.name
-            print(f"Model Name: {model_name}")
-            
-            # Get the latest version of the model
-            latest_version_info = client.get_registered_model(model_name).latest_versions[0]  # Latest version
-            model_tags = latest_version_info.tags
-
-            region = model_tags.get('region')
-            print(f'Region: {region}')
-            
-            if not region:
-                print(f"Warning: Model '{model_name}' has no 'region' tag. Skipping...")
-                continue
-
-            model_uri = latest_version_info.source
-            print(f"Model URI: {model_uri}")
-
-            all_region_models_dict[region] = {
-                'model_name': model_name,
-                'uri': model_uri,
-                'loaded_model': mlflow.pyfunc.load_model(model_uri),
-                'input_schema': make_input_schema(model_uri, model_name) 
-            }
-        
-        except Exception as e:
-            print(f"Error loading model '{model_name}': {e}")
-            continue  # Continue with the next model if there is an error
+    all_region_models_dict = list_registered_models(client)
+    lazy = os.getenv("MODEL_LOADING", "eager").lower() == 'lazy'
+
+    if not lazy and all_region_models_dict:
+        budget = (float(os.getenv("MODEL_LOAD_BUDGET_SECONDS", "0")) or None) if use_budget else None
+        executor = ThreadPoolExecutor(max_workers=int(os.getenv("MODEL_LOAD_WORKERS", "8")))
+        futures = {
+            executor.submit(load_model_entry, model_info): region
+            for region, model_info in all_region_models_dict.items()}
+        done, not_done = wait(futures, timeout=budget)
+        # Models over the budget are not waited for, their entries stay unloaded until requested
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for future in done:
+            region = futures[future]
+            try:
+                all_region_models_dict[region] = future.result()
+            except Exception as e:
+                print(f"Error loading model '{all_region_models_dict[region]['model_name']}': {e!r}")
+                del all_region_models_dict[region]
+        for future in not_done:
+            all_region_models_dict[futures[future]]['pending'] = future
+        if not_done:
+            print(f"Model load budget of {budget}s exceeded, {len(not_done)} models will load on first request")
 
     global all_region_models     
     all_region_models = all_region_models_dict
+    model_load_stats.update({
+        'mode': 'lazy' if lazy else 'eager',
+        'startup_seconds': time.perf_counter() - start,
+        'registered_models': len(all_region_models_dict),
+        'reload_generation': reload_generation,
+    })
+    print(f"Loaded model table in {model_load_stats['startup_seconds']:.2f}s")
+    return all_region_models_dict
 
 
-def validate_input_data(region: str = Path(...), data: List[dict] = Body(...)):
+def preload_models():
     """
-    Validate input data based on the region-specific schema.
+    Load the model table in the gunicorn master, before it forks the workers (see src/gunicorn_conf.py).
+    The workers then share the loaded models and imported modules copy-on-write instead of each loading
+    its own copy, and only the master reads the registry and downloads the models.
+    MODEL_LOAD_BUDGET_SECONDS does not apply: every model is waited for, as a load left for later would
+    run in a thread that does not survive the fork, and a cancelled one would drop the model in every worker.
+    """
+    import mlflow
+
+    load_dotenv()
+    mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
+    load_all_models(use_budget=False)
+    model_load_stats['preloaded'] = True
+    # Objects are moved out of the collector's reach: a collection in a worker would write to their
+    # headers and copy the memory pages they sit on
+    gc.collect()
+    gc.freeze()
+
+
+def load_model_entries(model_infos: dict):
+    """
+    Load several models concurrently with MODEL_LOAD_WORKERS threads.
+
+    Args:
+        model_infos (dict): Model name, version and uri per region.
+
+    Returns:
+        tuple: The loaded entries per region and the load errors per region.
+    """
+    loaded, errors = {}, {}
+    if not model_infos:
+        return loaded, errors
+    with ThreadPoolExecutor(max_workers=int(os.getenv("MODEL_LOAD_WORKERS", "8"))) as executor:
+        futures = {executor.submit(load_model_entry, model_info): region for region, model_info in model_infos.items()}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                loaded[region] = future.result()
+            except Exception as e:
+                print(f"Error loading model '{model_infos[region]['model_name']}': {e!r}")
+                errors[region] = repr(e)
+    return loaded, errors
+
+
+def reload_changed_models():
+    """
+    Rebuild the model table from the registry, loading only the models whose version changed,
+    and publish it with a single assignment so requests see either the old or the new table.
+
+    Returns:
+        dict: The reload report: changed, removed and failed regions with their load times,
+            the cached predictions dropped with the replaced models and the model versions pruned
+            from MODEL_CACHE_DIR.
+    """
+    import mlflow
+
+    global all_region_models
+    start = time.perf_counter()
+    listed_at = time.time()
+    current_models = all_region_models
+    registered_models = list_registered_models(mlflow.MlflowClient())
+
+    new_models, changed = {}, {}
+    for region, model_info in registered_models.items():
+        current_entry = current_models.get(region)
+        if (current_entry is not None and current_entry['model_name'] == model_info['model_name']
+                and current_entry['version'] == model_info['version']):
+            new_models[region] = current_entry
+        else:
+            changed[region] = model_info
+
+    if os.getenv("MODEL_LOADING", "eager").lower() == 'lazy':
+        loaded, errors = {}, {}
+        new_models.update(changed)
+    else:
+        loaded, errors = load_model_entries(changed)
+        new_models.update(loaded)
+        # A failed load keeps serving the previous version
+        for region in errors:
+            if region in current_models:
+                new_models[region] = current_models[region]
+
+    all_region_models = new_models
+    # Cached predictions of the models just replaced
+    removed = set(current_models) - set(registered_models)
+    cache_dropped = prediction_cache.drop_regions(
+        (set(changed) - set(errors)) | removed) if prediction_cache is not None else 0
+    # The versions just replaced stay in the shared cache until a reload with no failed load
+    cache_dir = os.getenv("MODEL_CACHE_DIR")
+    pruned = artifacts.prune_models(cache_dir, new_models.values(), listed_at) if cache_dir and not errors else []
+
+    return {
+        'changed': {
+            region: {
+                'from_version': current_models[region]['version'] if region in current_models else None,
+                'to_version': model_info['version'],
+                'load_seconds': loaded[region]['load_seconds'] if region in loaded else None,
+            }
+            for region, model_info in changed.items() if region not in errors
+        },
+        'removed': sorted(removed),
+        'failed': errors,
+        'cache_entries_dropped': cache_dropped,
+        'artifacts_pruned': len(pruned),
+        'unchanged': len(registered_models) - len(changed),
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def run_reload(notify_workers=True):
+    """
+    Body of the background reload thread, records the outcome in reload_status.
+
+    Args:
+        notify_workers (bool): Whether to tell the other workers sharing MODEL_CACHE_DIR to reload as well.
+    """
+    global seen_reload_generation
+    try:
+        report = reload_changed_models()
+        reload_status.update({'state': 'idle', 'last_reload': report, 'error': None})
+        if notify_workers and os.getenv("MODEL_CACHE_DIR"):
+            seen_reload_generation = artifacts.bump_reload_generation(os.getenv("MODEL_CACHE_DIR"))
+        print(f"Reloaded models in {report['seconds']:.2f}s, changed: {sorted(report['changed'])}")
+    except Exception as e:
+        reload_status.update({'state': 'failed', 'error': str(e)})
+        print(f"Error reloading models: {e}")
+    finally:
+        reload_lock.release()
+
+
+def watch_reloads(cache_dir: str, poll_seconds: float, stop: threading.Event, loaded_generation: int = 0):
+    """
+    Body of the reload watcher thread: reload the models when another worker sharing the artifact cache did.
+    A worker gunicorn forks after a reload starts with the master's table, loaded at an older generation,
+    and reloads on the first check.
+
+    Args:
+        cache_dir (str): The shared artifact cache, MODEL_CACHE_DIR.
+        poll_seconds (float): Time between checks of the reload generation.
+        stop (threading.Event): Set at shutdown.
+        loaded_generation (int): The reload generation the model table was loaded at.
+    """
+    global seen_reload_generation
+    seen_reload_generation = loaded_generation
+    while not stop.wait(poll_seconds):
+        generation = artifacts.reload_generation(cache_dir)
+        if generation != seen_reload_generation and reload_lock.acquire(blocking=False):
+            seen_reload_generation = generation
+            reload_status.update({'state': 'running', 'started_at': dt.datetime.now().isoformat()})
+            run_reload(notify_workers=False)
+
+
+def validate_records(region: str, data: List[dict], model_entry: dict):
+    """
+    Validate the records of a single region against its schema, column-wise, into the model input array.
 
     Args:
         region (str): The region for which the data is being validated.
         data (List[dict]): The input data to be validated.
+        model_entry (dict): The model entry of the region, None if there is no model for it.
 
     Returns:
-        List[dict]: The validated data.
+        np.ndarray: The validated data, one row per record in the model feature order.
 
     Raises:
         HTTPException: If the region schema is not found or data is invalid.
     """
-    if region not in all_region_models:
+    if model_entry is None:
         raise HTTPException(status_code=400, detail=f"Schema for region '{region}' not found")
 
-    schema = all_region_models[region]['input_schema']
+    start = time.perf_counter()
+    validator = model_entry['validator']
     try:
-        validated_data = [schema(**item).dict() for item in data]
+        validated_data = validator.validate(data)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid data: {str(e)}")
+    if 'region_code' in model_entry:
+        region_code_position = model_entry['feature_names'].index(model_entry['region_code_column'])
+        validated_data[:, region_code_position] = model_entry['region_code']
+    metrics.observe_stage(region, 'validation', time.perf_counter() - start)
+    return validated_data
+
+
+async def validate_input_data(region: str = Path(...), data: List[dict] = Body(...),
+                              model_entry: dict = Depends(get_region_model)):
+    """
+    Validate input data based on the region-specific schema.
+    Requests of up to INLINE_VALIDATION_ROWS records are validated on the event loop, which takes less
+    time than handing them to the thread pool. Larger ones go to the thread pool.
+
+    Args:
+        region (str): The region for which the data is being validated.
+        data (List[dict]): The input data to be validated.
+        model_entry (dict): The model entry of the region.
+
+    Returns:
+        np.ndarray: The validated data.
+
+    Raises:
+        HTTPException: If the region schema is not found or data is invalid.
+    """
+    if len(data) <= INLINE_VALIDATION_ROWS:
+        return validate_records(region, data, model_entry)
+    return await run_in_threadpool(validate_records, region, data, model_entry)
+
+
+def validate_batch_input_data(data: Dict[str, List[dict]] = Body(...),
+                              region_models: dict = Depends(get_model_table)):
+    """
+    Validate the records of every region in a batch request, reporting all failing regions at once.
+
+    Args:
+        data (Dict[str, List[dict]]): Mapping of region to its input records.
+        region_models (dict): The model table snapshot of the request.
+
+    Returns:
+        Dict[str, np.ndarray]: The validated data per region.
+
+    Raises:
+        HTTPException: If any region is unknown or has invalid data.
+    """
+    validated_data, errors = {}, {}
+    for region, records in data.items():
+        try:
+            validated_data[region] = validate_records(region, records, get_model_entry(region, region_models))
+        except HTTPException as e:
+            errors[region] = e.detail
+    if errors:
+        raise HTTPException(status_code=400, detail=errors)
     return validated_data
 
+
+def make_model_input(validated_data: np.ndarray, model_entry: dict):
+    """
+    Build the DataFrame fed to the pyfunc model from validated rows, with the column types of the signature.
+
+    Args:
+        validated_data (np.ndarray): The validated input data.
+        model_entry (dict): The model entry the data was validated against.
+
+    Returns:
+        pd.DataFrame: The model input.
+    """
+    # Integers as int32 to avoid typing errors
+    return pd.DataFrame({
+        name: validated_data[:, i].astype(dtype)
+        for i, (name, dtype) in enumerate(model_entry['validator'].frame_dtypes.items())})
+
+
+def predict_records(model_entry: dict, validated_data: np.ndarray, region: str = None):
+    """
+    Run a loaded model on validated rows, through the native booster when SERVING_MODE=native.
+
+    Args:
+        model_entry (dict): The entry of the model in all_region_models.
+        validated_data (np.ndarray): The validated input data, in the model feature order.
+        region (str): The region the stage metrics are recorded under, defaults to the model name.
+
+    Returns:
+        np.ndarray: The predictions.
+    """
+    region = region or model_entry['model_name']
+    start = time.perf_counter()
+    if 'booster' in model_entry:
+        model_input = validated_data.astype(np.float32, copy=False)
+    else:
+        model_input = make_model_input(validated_data, model_entry)
+    built = time.perf_counter()
+    if 'booster' in model_entry:
+        prediction = model_entry['booster'].inplace_predict(model_input)
+    else:
+        prediction = model_entry['loaded_model'].predict(model_input)
+    metrics.observe_stage(region, 'build_input', built - start)
+    metrics.observe_stage(region, 'predict', time.perf_counter() - built)
+    metrics.observe_predict_rows(len(validated_data))
+    return prediction
+
 all_region_models = {}
+# Per region locks, so a model left for its first request is only loaded once
+model_load_locks = {}
+model_load_stats = {}
+# Loaded global models by (model name, version), shared by the entries of their regions
+shared_models = {}
+shared_model_locks = {}
+shared_models_lock = threading.Lock()
+# Only one background reload at a time
+reload_lock = threading.Lock()
+reload_status = {'state': 'idle', 'last_reload': None, 'error': None}
+# Last reload generation of the shared artifact cache this worker reloaded for, and the watcher's stop event
+seen_reload_generation = 0
+reload_watcher_stop = threading.Event()
+# Recent raw weekly history per region, for computing features server side
+history_store = features.HistoryStore()
+feature_plans = {}
+# Coalesces concurrent /predict/{region} requests into shared model calls, None when MICRO_BATCHING is off
+micro_batcher = None
+# Largest request validated on the event loop, about a millisecond of validation
+INLINE_VALIDATION_ROWS = 256
+# Predictions of recent requests, None when PREDICTION_CACHE_SIZE is 0
+prediction_cache = None
 
 # Lifespan event for FastAPI (runs before handling requests)
 @asynccontextmanager
@@ -138,44 +661,296 @@ async def lifespan(app: FastAPI):
     Yields:
         None
     """
+    import mlflow
+
     load_dotenv()
-    # Glogal var to store models in memory
-    all_region_models = None
     mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI"))
-
-    all_region_models = load_all_models()
+    metrics.enabled = os.getenv("METRICS_ENABLED", "true").lower() != "false"
+
+    # Fills the global all_region_models, unless the gunicorn master already did before forking this worker
+    if not model_load_stats.get('preloaded'):
+        load_all_models()
+
+    if os.getenv("MODEL_CACHE_DIR"):
+        reload_watcher_stop.clear()
+        threading.Thread(
+            target=watch_reloads, daemon=True,
+            args=(os.getenv("MODEL_CACHE_DIR"), float(os.getenv("MODEL_RELOAD_POLL_SECONDS", "1")),
+                  reload_watcher_stop, model_load_stats.get('reload_generation', 0))).start()
+
+    global history_store
+    history_store = features.HistoryStore(int(os.getenv("HISTORY_WEEKS", "64")))
+    if os.getenv("HISTORY_PATH"):
+        history_store.load_csv(os.getenv("HISTORY_PATH"))
+        print(f"Loaded history of {len(history_store.histories)} regions from {os.getenv('HISTORY_PATH')}")
+
+    global prediction_cache
+    cache_size = int(os.getenv("PREDICTION_CACHE_SIZE", "0"))
+    prediction_cache = caching.PredictionCache(
+        cache_size, float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "0"))) if cache_size > 0 else None
+
+    global micro_batcher
+    if os.getenv("MICRO_BATCHING", "false").lower() == 'true':
+        micro_batcher = batching.MicroBatcher(
+            predict_records,
+            max_batch_rows=int(os.getenv("MICRO_BATCH_MAX_ROWS", "256")),
+            max_wait_seconds=float(os.getenv("MICRO_BATCH_MAX_WAIT_MS", "2")) / 1000)
+    else:
+        micro_batcher = None
     
     yield
 
     print("🛑 Shutting down API...")
+    reload_watcher_stop.set()
     all_region_models.clear()
 
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware, known_regions=lambda: all_region_models)
+
+
+def distinct_models(region_models: dict):
+    """
+    The loaded entries of a model table, once per model (the regions of a global model share one).
+
+    Args:
+        region_models (dict): The model table.
+
+    Returns:
+        list: One loaded entry per model name and version.
+    """
+    models = {}
+    for model_entry in region_models.values():
+        if model_entry['loaded']:
+            models[model_entry['model_name'], model_entry['version']] = model_entry
+    return list(models.values())
+
+
+metrics.models_registered.set_function(lambda: len(all_region_models))
+metrics.models_loaded.set_function(lambda: len(distinct_models(all_region_models)))
+metrics.model_bytes.set_function(
+    lambda: sum(model_entry.get('model_bytes', 0) for model_entry in distinct_models(all_region_models)))
+metrics.register_prediction_cache(lambda: prediction_cache.stats() if prediction_cache is not None else None)
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus metrics: request counts and latencies per route and region, stage latencies
+    (validation, build_input, predict), batch sizes, and the loaded models with their approximate memory.
+
+    Returns:
+        Response: The metrics in the Prometheus text exposition format.
+    """
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
 
 @app.post("/reload-models")
 def reload_models():
     """
-    Reload all registered models from MLflow and update the global dictionary.
+    Start reloading the registered models from MLflow in the background. Only models whose registered
+    version changed are loaded, and the new table replaces the old one in a single swap, so predictions
+    keep being served from the previous models meanwhile. Workers sharing a MODEL_CACHE_DIR reload as well
+    once this one is done.
+
+    Returns:
+        dict: A message indicating whether a reload was started.
+    """
+    if not reload_lock.acquire(blocking=False):
+        return {"message": "Model reload already running"}
+    reload_status.update({'state': 'running', 'started_at': dt.datetime.now().isoformat()})
+    threading.Thread(target=run_reload, daemon=True).start()
+    return {"message": "Model reload started"}
+
+@app.get("/reload-models")
+def reload_models_status():
+    """
+    Report the state of the background reload and what the last one changed.
+
+    Returns:
+        dict: The reload state, the last reload report and the last error, if any.
+    """
+    return reload_status
+
+@app.get("/models")
+def list_models():
+    """
+    Report how the model table was loaded: startup time and, per region, version and load time.
+
+    Returns:
+        dict: The loading mode, startup time, the worker process and model details per region.
+    """
+    region_models = all_region_models
+    return {
+        **model_load_stats,
+        'pid': os.getpid(),
+        'models': {
+            region: {
+                'model_name': model_entry['model_name'],
+                'version': model_entry['version'],
+                'loaded': model_entry['loaded'],
+                'load_seconds': model_entry.get('load_seconds'),
+            }
+            for region, model_entry in region_models.items()
+        },
+    }
+
+def lookup_prediction(region: str, model_entry: dict, validated_data: np.ndarray):
+    """
+    Look the predictions of validated rows up in the prediction cache.
+
+    Args:
+        region (str): The region of the request.
+        model_entry (dict): The model entry the rows were validated against.
+        validated_data (np.ndarray): The validated input data.
+
+    Returns:
+        tuple: The cache key (None when the cache is off) and the cached predictions (None on a miss).
+    """
+    if prediction_cache is None:
+        return None, None
+    key = prediction_cache.key(region, model_entry, validated_data)
+    return key, prediction_cache.get(key)
+
+
+def store_prediction(key, prediction: np.ndarray):
+    if key is not None:
+        prediction_cache.put(key, prediction)
+
+
+def get_feature_plan(model_entry: dict):
+    """
+    Parse (once per feature list) how to compute the model input columns from the region histories.
+
+    Args:
+        model_entry (dict): The model entry.
 
     Returns:
-        dict: A message indicating the models have been reloaded.
+        features.FeaturePlan: The feature plan of the model.
     """
-    load_all_models()
-    return {"message": "Models reloaded successfully"}
+    feature_names = tuple(model_entry['feature_names'])
+    if feature_names not in feature_plans:
+        feature_plans[feature_names] = features.FeaturePlan(feature_names)
+    return feature_plans[feature_names]
+
+
+# Server side features Endpoint
+@app.post("/forecast/{region}")
+def forecast(region: str,
+             request: features.ForecastRequest = Body(...),
+             model_entry: dict = Depends(get_region_model)
+             ):
+    """
+    Forecast avocado prices for a region from the server side history instead of client computed features.
+    Observations in the request (raw avocado.csv rows, of this or any aux region) are added to the history first,
+    and the feature row of each type is computed from the history for the requested date.
+
+    Args:
+        region (str): The region for which the forecast is made.
+        request (features.ForecastRequest): The forecast date, types and new observations.
+        model_entry (dict): The model entry of the region.
+
+    Returns:
+        dict: The forecast date, prediction per type and the features the history could not provide.
+
+    Raises:
+        HTTPException: If the region has no model or no history, an observation is older than its region's
+            history, the date is outside the history window, or the features cannot be computed.
+    """
+    if model_entry is None:
+        raise HTTPException(status_code=404, detail=f"Model for region '{region}' not found.")
+    try:
+        history_store.add_observations(request.observations, default_region=region)
+        plan = get_feature_plan(model_entry)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    with history_store.lock:
+        if region not in history_store.histories:
+            raise HTTPException(status_code=404, detail=f"No history for region '{region}', post observations first.")
+        history = history_store.histories[region]
+        first_date, last_date = plan.date_window(history)
+        forecast_date = request.date or last_date
+        if not first_date <= forecast_date <= last_date:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Date {forecast_date} is outside the history window of '{region}', {first_date} to {last_date}")
+        type_names = request.types or features.TYPES
+        rows = plan.compute(
+            history_store.histories, region, forecast_date, type_names, region_code=model_entry.get('region_code'))
+
+    key, prediction = lookup_prediction(region, model_entry, rows)
+    if prediction is None:
+        prediction = predict_records(model_entry, rows, region)
+        store_prediction(key, prediction)
+    missing_features = [name for name, value in zip(plan.feature_names, rows[0]) if np.isnan(value)]
+    return {
+        "region": region,
+        "date": forecast_date.isoformat(),
+        "predictions": dict(zip(type_names, prediction.tolist())),
+        "missing_features": missing_features,
+    }
+
+# Batch Prediction Endpoint, declared before /predict/{region} so "batch" is not taken as a region
+@app.post("/predict/batch")
+def predict_batch(validated_data: Dict[str, np.ndarray] = Depends(validate_batch_input_data),
+                  region_models: dict = Depends(get_model_table)):
+    """
+    Predict avocado prices for several regions in one request.
+    Regions served by the same model are stacked and predicted with a single model call,
+    regions whose predictions are cached are answered from the cache.
+    Input Data is a mapping of region to records in the orient='records'
+
+    Args:
+        validated_data (Dict[str, np.ndarray]): The validated input data per region.
+        region_models (dict): The model table snapshot of the request.
+
+    Returns:
+        dict: The prediction results per region.
+    """
+    metrics.observe_records("/predict/batch", sum(len(records) for records in validated_data.values()))
+    predictions, cache_keys, regions_by_model = {}, {}, {}
+    for region in validated_data:
+        cache_keys[region], prediction = lookup_prediction(
+            region, get_model_entry(region, region_models), validated_data[region])
+        if prediction is not None:
+            predictions[region] = prediction.tolist()
+        else:
+            regions_by_model.setdefault(region_models[region]['model_name'], []).append(region)
+
+    for regions in regions_by_model.values():
+        rows = np.concatenate([validated_data[region] for region in regions])
+        if not len(rows):
+            predictions.update({region: [] for region in regions})
+            continue
+        # Stage metrics of a model call stacking several regions are recorded under the model name
+        prediction = predict_records(
+            get_model_entry(regions[0], region_models), rows, regions[0] if len(regions) == 1 else None)
+
+        offset = 0
+        for region in regions:
+            n_records = len(validated_data[region])
+            store_prediction(cache_keys[region], prediction[offset:offset + n_records])
+            predictions[region] = prediction[offset:offset + n_records].tolist()
+            offset += n_records
+
+    return {"predictions": predictions}
 
 # Prediction Endpoint
 @app.post("/predict/{region}")
-def predict(region:str, 
-            validated_data: List[dict] = Depends(validate_input_data)
+async def predict(region:str, 
+            validated_data: np.ndarray = Depends(validate_input_data),
+            model_entry: dict = Depends(get_region_model)
             ):
     """
     Predict avocado price for the given region using its specific model and schema.
     Input Data needs to be in the orient='records'
+    With MICRO_BATCHING=true, the rows of concurrent requests to the same model are predicted together.
+    With a PREDICTION_CACHE_SIZE, repeated requests are answered from the prediction cache.
 
     Args:
         region (str): The region for which the prediction is made.
-        validated_data (List[dict]): The validated input data.
+        validated_data (np.ndarray): The validated input data.
+        model_entry (dict): The model entry the data was validated against.
 
     Returns:
         dict: The prediction results.
@@ -184,17 +959,18 @@ def predict(region:str,
         HTTPException: If the model for the region is not found.
     """
     
-    if region not in all_region_models:
+    if model_entry is None:
         raise HTTPException(status_code=404, detail=f"Model for region '{region}' not found.")
 
-    df = pd.DataFrame.from_dict(validated_data)
-    
-    # Convert int64 to int32 to avoid typing errors 
-    for col in df.select_dtypes(include=['int']).columns:
-        df[col] = df[col].astype(np.int32)
+    metrics.observe_records("/predict/{region}", len(validated_data))
+    key, prediction = lookup_prediction(region, model_entry, validated_data)
+    if prediction is not None:
+        return {"region": region, "prediction": prediction.tolist()}
 
-    # fetch correct model
-    model = all_region_models[region]['loaded_model']
-    prediction = model.predict(df)
+    if micro_batcher is not None:
+        prediction = await micro_batcher.predict(model_entry, validated_data, region)
+    else:
+        prediction = await run_in_threadpool(predict_records, model_entry, validated_data, region)
+    store_prediction(key, prediction)
 
-    return {"region": region, "prediction": prediction.tolist()}
\ No newline at end of file
+    return {"region": region, "prediction": prediction.tolist()}
@@ -0,0 +1,120 @@
+"""
+Local cache of downloaded model artifacts, shared by the API processes of a host.
+
+Without it every process downloads every model from MLflow into its own temporary directory. With
+MODEL_CACHE_DIR set, a model version is downloaded once into <dir>/<model name>/<version>-<source digest>,
+under a per model file lock so that of several workers starting together only the first one downloads it,
+and the others wait and read the same files. The digest covers the tracking URI, the run and the artifact
+source of the version, as model names and versions repeat between registries (a recreated MLflow database
+numbers them from 1 again) and must not be served the files of another registry's model.
+
+Downloads go to a temporary directory renamed into place when complete, so a directory in the cache is
+always a whole model. After a reload, the versions the reloading worker no longer uses are deleted, under
+the same lock, so the cache holds the versions in service rather than every version ever downloaded.
+
+The cache also carries the reload generation: a worker that reloads the models touches it, and the other
+workers watch it and reload too, since a /reload-models request only reaches one of them.
+"""
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+
+RELOAD_FILE = 'reload-generation'
+
+
+def model_dir(cache_dir: str, model_info: dict, tracking_uri: str = ''):
+    source = '\0'.join([tracking_uri or '', model_info.get('run_id') or '', model_info['uri']])
+    digest = hashlib.blake2b(source.encode(), digest_size=8).hexdigest()
+    return os.path.join(cache_dir, model_info['model_name'], f"{model_info['version']}-{digest}")
+
+
+def download_model(model_info: dict, cache_dir: str = None):
+    """
+    Local path of a registered model version, downloaded into the cache first if it is not there yet.
+
+    Args:
+        model_info (dict): Model name, version, run id and uri, as returned by list_registered_models.
+        cache_dir (str): The cache directory, None to download into a temporary directory as mlflow does.
+
+    Returns:
+        str: The local directory of the model.
+    """
+    import mlflow
+    import mlflow.artifacts
+
+    if not cache_dir:
+        return mlflow.artifacts.download_artifacts(artifact_uri=model_info['uri'])
+
+    target = model_dir(cache_dir, model_info, mlflow.get_tracking_uri())
+    if os.path.isdir(target):
+        return target
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(f"{os.path.dirname(target)}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # Another process may have finished the download while this one waited for the lock
+        if not os.path.isdir(target):
+            download_dir = tempfile.mkdtemp(dir=os.path.dirname(target), prefix='.download-')
+            try:
+                local_path = mlflow.artifacts.download_artifacts(artifact_uri=model_info['uri'], dst_path=download_dir)
+                os.replace(local_path, target)
+            finally:
+                shutil.rmtree(download_dir, ignore_errors=True)
+            print(f"Downloaded model '{model_info['model_name']}' v{model_info['version']} to {target}")
+    return target
+
+
+def prune_models(cache_dir: str, model_infos, downloaded_before: float):
+    """
+    Delete the cached model versions none of `model_infos` uses, each model under its download lock.
+    Only versions downloaded before `downloaded_before` are deleted: a later one may have been downloaded by
+    another worker for a registry change this one has not seen yet. A worker that still needs a deleted
+    version (a model left for its first request) downloads it again.
+
+    Args:
+        cache_dir (str): The cache directory.
+        model_infos: Model name, version, run id and uri of every model in use, as in the model table.
+        downloaded_before (float): Time (time.time()) the listing of the models in use was read at.
+
+    Returns:
+        list: The deleted paths.
+    """
+    import mlflow
+
+    keep = {model_dir(cache_dir, model_info, mlflow.get_tracking_uri()) for model_info in model_infos}
+    removed = []
+    for model_name in sorted(os.listdir(cache_dir)):
+        name_dir = os.path.join(cache_dir, model_name)
+        if not os.path.isdir(name_dir):
+            continue
+        with open(f"{name_dir}.lock", 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            for entry in os.listdir(name_dir):
+                path = os.path.join(name_dir, entry)
+                if path in keep or os.path.getmtime(path) >= downloaded_before:
+                    continue
+                # Version directories, leftovers of interrupted downloads and per version locks of older caches
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+                removed.append(path)
+    return removed
+
+
+def reload_generation(cache_dir: str):
+    """ Modification time of the reload file, 0 before the first reload """
+    try:
+        return os.stat(os.path.join(cache_dir, RELOAD_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def bump_reload_generation(cache_dir: str):
+    """ Tell the other workers sharing the cache to reload, returns the new generation """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, RELOAD_FILE)
+    with open(path, 'a'):
+        os.utime(path)
+    return reload_generation(cache_dir)
@@ -0,0 +1,110 @@
+"""
+Micro-batching of concurrent /predict requests.
+
+Each request served on its own makes its own model call, and a model call costs about the same for one row as
+for a few hundred. The MicroBatcher queues the validated rows of concurrent requests per model (so the regions
+of a global model share a queue) and sends them as one model call when the queue holds max_batch_rows rows or
+its first request has waited max_wait_seconds, whichever comes first. Each request then gets its own slice of
+the predictions back.
+
+Only one call per model runs at a time: concurrent calls of the same model would only compete for the same
+cores. A batch that comes due while a call runs keeps taking requests and goes as soon as the call returns.
+
+It runs on the event loop of the app. Model calls go to the thread pool, so the loop keeps queueing requests
+while a batch is predicted.
+"""
+import asyncio
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent predictions of the same model into one model call, see the module docstring.
+
+    Args:
+        predict (callable): predict(model_entry, rows, region) -> predictions, run in the thread pool.
+        max_batch_rows (int): Rows that make a batch due without waiting any longer.
+        max_wait_seconds (float): Longest a request waits for others to join its batch.
+    """
+
+    def __init__(self, predict, max_batch_rows=256, max_wait_seconds=0.002):
+        self.predict_rows = predict
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_seconds = max_wait_seconds
+        # Open batch per (model name, version): entry, rows, regions, futures, row count, due flag and timer
+        self.pending = {}
+        # Models with a call in flight
+        self.running = set()
+        # Running model calls, referenced so they are not garbage collected mid-flight
+        self.tasks = set()
+
+    async def predict(self, model_entry: dict, rows: np.ndarray, region: str):
+        """
+        Queue validated rows for the next model call of their model and wait for their predictions.
+
+        Args:
+            model_entry (dict): The model entry the rows were validated against.
+            rows (np.ndarray): The validated input data.
+            region (str): The region of the request.
+
+        Returns:
+            np.ndarray: The predictions of the rows.
+        """
+        loop = asyncio.get_running_loop()
+        key = (model_entry['model_name'], model_entry['version'])
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = {
+                'model_entry': model_entry, 'rows': [], 'regions': set(), 'futures': [], 'n_rows': 0,
+                'due': False, 'timer': loop.call_later(self.max_wait_seconds, self.make_due, key)}
+        future = loop.create_future()
+        batch['rows'].append(rows)
+        batch['regions'].add(region)
+        batch['futures'].append(future)
+        batch['n_rows'] += len(rows)
+        if batch['n_rows'] >= self.max_batch_rows:
+            self.make_due(key)
+        return await future
+
+    def make_due(self, key):
+        batch = self.pending.get(key)
+        if batch is not None:
+            batch['due'] = True
+            self.dispatch(key)
+
+    def dispatch(self, key):
+        """ Start the model call of a model's open batch, if it is due and the model has no call running """
+        batch = self.pending.get(key)
+        if batch is None or not batch['due'] or key in self.running:
+            return
+        del self.pending[key]
+        batch['timer'].cancel()
+        self.running.add(key)
+        task = asyncio.get_running_loop().create_task(self.run_batch(key, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run_batch(self, key, batch):
+        rows = batch['rows'][0] if len(batch['rows']) == 1 else np.concatenate(batch['rows'])
+        # Stage metrics of a batch of several regions are recorded under the model name
+        region = next(iter(batch['regions'])) if len(batch['regions']) == 1 else None
+        try:
+            prediction = await run_in_threadpool(self.predict_rows, batch['model_entry'], rows, region)
+        except Exception as e:
+            for future in batch['futures']:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.running.discard(key)
+            # A batch that came due during this call goes next
+            self.dispatch(key)
+
+        offset = 0
+        for future, request_rows in zip(batch['futures'], batch['rows']):
+            # A request whose client went away is cancelled, its slice is dropped
+            if not future.done():
+                future.set_result(prediction[offset:offset + len(request_rows)])
+            offset += len(request_rows)
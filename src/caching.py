@@ -0,0 +1,90 @@
+"""
+Cache of prediction results, for clients that request the same forecasts again between model updates.
+
+Entries are keyed by region, registered model name and version, and a hash of the validated feature rows.
+Validation has already turned the records into the model input array, so records that only differ in how
+their values are written (2 and 2.0, extra fields, field order) share an entry. The cache is a bounded LRU,
+and entries older than the TTL count as misses. A reload that changes the model of a region drops its
+entries right away. The version in the key would make them unreachable anyway, but would leave them taking
+space until they are evicted.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions with a TTL, shared by the request threads and the event loop.
+
+    Args:
+        max_entries (int): Entries kept, the least recently used one is evicted past it.
+        ttl_seconds (float): Age at which an entry expires, 0 to keep entries until evicted.
+    """
+
+    def __init__(self, max_entries=10000, ttl_seconds=0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    @staticmethod
+    def key(region: str, model_entry: dict, rows: np.ndarray):
+        """
+        Cache key of a prediction request.
+
+        Args:
+            region (str): The region of the request.
+            model_entry (dict): The model entry the rows were validated against.
+            rows (np.ndarray): The validated input data.
+
+        Returns:
+            tuple: Region, model name and version, and the shape, dtype and digest of the rows.
+        """
+        rows = np.ascontiguousarray(rows)
+        digest = hashlib.blake2b(rows.data, digest_size=16).digest()
+        return region, model_entry['model_name'], model_entry['version'], rows.shape, rows.dtype.str, digest
+
+    def get(self, key):
+        """ The cached predictions of a key, None on a miss """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl_seconds and time.monotonic() - entry[0] > self.ttl_seconds:
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, prediction: np.ndarray):
+        # Read only, the cached array is handed to every request that hits it
+        prediction = np.array(prediction)
+        prediction.setflags(write=False)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), prediction)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def drop_regions(self, regions):
+        """ Drop the entries of the given regions, returns how many were dropped """
+        regions = set(regions)
+        with self.lock:
+            keys = [key for key in self.entries if key[0] in regions]
+            for key in keys:
+                del self.entries[key]
+        return len(keys)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions, 'expirations': self.expirations}
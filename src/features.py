@@ -0,0 +1,264 @@
+import datetime as dt
+import re
+import threading
+from typing import Dict, List, Literal, Optional, get_args
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, ConfigDict, Field
+
+TypeName = Literal['conventional', 'organic']
+TYPES = list(get_args(TypeName))
+RAW_COLUMNS = ['AveragePrice', 'TotalVolume', '4046', '4225', '4770', 'TotalBags', 'SmallBags', 'LargeBags', 'XLargeBags']
+# Stage 1 columns of a week, as built by modelling/data_processing.py: one per raw column and type, plus combined
+STAGE_1_COLUMNS = [f'{col}_{type_name}' for col in RAW_COLUMNS for type_name in TYPES + ['combined']]
+STAGE_1_INDEX = {col: i for i, col in enumerate(STAGE_1_COLUMNS)}
+
+LAG_FEATURE = re.compile(r'^(?:(?P<region>[^_]+)_)?(?P<column>.+)_lag_(?P<lag>\d+)$')
+ROLLING_FEATURE = re.compile(r'^rolling_(?P<size>\d+)_(?P<stat>mean|std|min|max)$')
+# modelling/feature_eng.make_rolling computes the rolling window on this column
+ROLLING_SOURCE_COLUMN, ROLLING_SOURCE_LAG = 'AveragePrice_combined', 4
+ROLLING_STATS = {'mean': np.mean, 'std': np.std, 'min': np.min, 'max': np.max}
+# Models trained before make_rolling wrote each stat to its own column only have rolling_{size}_mean,
+# which held the rolling min: every stat overwrote it in turn and min was computed last
+LEGACY_ROLLING_STATS = {'mean': np.min}
+TIME_FEATURES = [
+    'Year', 'MonthSin', 'MonthCos', 'Day', 'DayofWeekSin', 'DayofWeekCos',
+    'WeekofYearSin', 'WeekofYearCos', 'QuarterSin', 'QuarterCos', 'TimeIndex']
+# Categorical region column of a global model, see modelling/train_models.train_global_model
+REGION_CODE_FEATURE = 'RegionCode'
+
+
+class RawObservation(BaseModel):
+    """
+    One weekly row of a region and type, in the avocado.csv schema.
+    """
+    model_config = ConfigDict(populate_by_name=True)
+
+    Date: dt.date
+    AveragePrice: float
+    TotalVolume: float = Field(alias='Total Volume')
+    PLU4046: float = Field(alias='4046')
+    PLU4225: float = Field(alias='4225')
+    PLU4770: float = Field(alias='4770')
+    TotalBags: float = Field(alias='Total Bags')
+    SmallBags: float = Field(alias='Small Bags')
+    LargeBags: float = Field(alias='Large Bags')
+    XLargeBags: float = Field(alias='XLarge Bags')
+    type: TypeName
+    region: Optional[str] = None
+
+    def raw_values(self):
+        return [
+            self.AveragePrice, self.TotalVolume, self.PLU4046, self.PLU4225, self.PLU4770,
+            self.TotalBags, self.SmallBags, self.LargeBags, self.XLargeBags]
+
+
+class ForecastRequest(BaseModel):
+    """
+    Forecast request: the date to forecast (defaults to the furthest date the history allows), the types to
+    forecast (defaults to all) and raw observations to add to the history first.
+    """
+    date: Optional[dt.date] = None
+    types: Optional[List[TypeName]] = None
+    observations: List[RawObservation] = []
+
+
+class RegionHistory:
+    """
+    Ring buffer of the last `capacity` weeks of a region's stage 1 columns, indexed by week number.
+
+    Week numbers count from the region's first observed date, the origin of the TimeIndex feature, and a slot
+    is only valid while it still holds the week it was written for.
+    """
+
+    def __init__(self, origin: dt.date, capacity: int):
+        self.origin = np.datetime64(origin, 'D')
+        self.capacity = capacity
+        self.weeks = np.full(capacity, -1, dtype=np.int64)
+        self.values = np.full((capacity, len(STAGE_1_COLUMNS)), np.nan)
+        self.last_week = -1
+
+    def week_number(self, date):
+        return (np.datetime64(date, 'D') - self.origin).astype(np.int64) // 7
+
+    def add(self, date: dt.date, type_name: str, raw_values: List[float]):
+        week = int(self.week_number(date))
+        if week < 0:
+            raise ValueError(f"Observation on {date} is older than the region history origin {self.origin}")
+        if week <= self.last_week - self.capacity:
+            return  # Older than anything the buffer keeps
+        slot = week % self.capacity
+        if self.weeks[slot] != week:
+            self.weeks[slot] = week
+            self.values[slot] = np.nan
+        row = self.values[slot]
+        for col, value in zip(RAW_COLUMNS, raw_values):
+            row[STAGE_1_INDEX[f'{col}_{type_name}']] = value
+
+        # Combined columns over the types observed so far, as data_processing.group_by_region computes them
+        type_values = np.array([[row[STAGE_1_INDEX[f'{col}_{t}']] for col in RAW_COLUMNS] for t in TYPES])
+        type_values = type_values[~np.isnan(type_values[:, 0])]
+        volumes = type_values[:, 1]
+        combined = type_values.sum(axis=0)
+        combined[0] = (type_values[:, 0] * volumes).sum() / volumes.sum()
+        for col, value in zip(RAW_COLUMNS, combined):
+            row[STAGE_1_INDEX[f'{col}_combined']] = value
+        self.last_week = max(self.last_week, week)
+
+    def gather(self, weeks: np.ndarray, columns: np.ndarray):
+        """ values[week, column] for each (broadcast) pair, NaN where the week is not (or no longer) in the buffer """
+        weeks, columns = np.broadcast_arrays(weeks, columns)
+        slots = weeks % self.capacity
+        gathered = self.values[slots, columns]
+        gathered[(self.weeks[slots] != weeks) | (weeks < 0)] = np.nan
+        return gathered
+
+    def week_date(self, week: int):
+        return (self.origin + np.timedelta64(7 * int(week), 'D')).item()
+
+
+class FeaturePlan:
+    """
+    How to compute each input column of a model from region histories, parsed once from the signature names.
+
+    Lags are taken in calendar weeks. Training shifts rows, which is the same thing as long as the region has
+    no missing weeks.
+    """
+
+    def __init__(self, feature_names: List[str]):
+        self.feature_names = list(feature_names)
+        lags = []  # (position, region or None, stage 1 column index, lag)
+        self.rolling = []  # (position, window size, stat function)
+        self.time = []  # (position, time feature name)
+        self.types = []  # (position, type name)
+        self.region_code_position = None
+        rolling_stats = ROLLING_STATS
+        if {match['stat'] for match in map(ROLLING_FEATURE.match, self.feature_names) if match} == {'mean'}:
+            rolling_stats = LEGACY_ROLLING_STATS
+        for position, name in enumerate(self.feature_names):
+            lag_match = LAG_FEATURE.match(name)
+            rolling_match = ROLLING_FEATURE.match(name)
+            own_column = name.split('_lag_')[0]
+            if rolling_match:
+                stat = rolling_stats[rolling_match['stat']]
+                self.rolling.append((position, int(rolling_match['size']), stat))
+            elif name in TIME_FEATURES:
+                self.time.append((position, name))
+            elif name == REGION_CODE_FEATURE:
+                self.region_code_position = position
+            elif name.startswith('Type_'):
+                self.types.append((position, name[len('Type_'):]))
+            elif lag_match and own_column in STAGE_1_INDEX:
+                lags.append((position, None, STAGE_1_INDEX[own_column], int(lag_match['lag'])))
+            elif lag_match and lag_match['column'] in STAGE_1_INDEX:
+                # Aux region lag, {region}_{column}_lag_{lag}
+                lags.append((position, lag_match['region'], STAGE_1_INDEX[lag_match['column']], int(lag_match['lag'])))
+            else:
+                raise ValueError(f"Don't know how to compute feature '{name}' server side")
+        # Lags grouped by source region (None for the own region), so each source is a single gather
+        self.lag_groups = {}
+        for lag_region in dict.fromkeys(region for _, region, _, _ in lags):
+            group = [(position, column, lag) for position, region, column, lag in lags if region == lag_region]
+            self.lag_groups[lag_region] = tuple(np.array(values) for values in zip(*group))
+
+        # How many weeks past the last observation every lag can still be computed for
+        horizon_lags = [lag for *_, lag in lags] + ([ROLLING_SOURCE_LAG] if self.rolling else [])
+        self.horizon = min(horizon_lags, default=1)
+        # How many weeks before the forecast date the oldest week read is
+        lookback_lags = [lag for *_, lag in lags] + [
+            ROLLING_SOURCE_LAG + size - 1 for _, size, _ in self.rolling]
+        self.lookback = max(lookback_lags, default=0)
+
+    def date_window(self, history: RegionHistory):
+        """ First and last date the region's own features can be computed for: from the origin, or the oldest
+        date whose weeks the buffer still holds, to `horizon` weeks past the last observation """
+        first_week = max(0, history.last_week - history.capacity + 1 + self.lookback)
+        return history.week_date(first_week), history.week_date(history.last_week + self.horizon)
+
+    def compute(self, histories: Dict[str, RegionHistory], region: str, date: dt.date, type_names: List[str],
+                region_code: Optional[int] = None):
+        """ One feature row per type for `date`, NaN where the history lacks a needed week """
+        history = histories[region]
+        week = history.week_number(date)
+        row = np.full(len(self.feature_names), np.nan)
+
+        for lag_region, (positions, columns, lags) in self.lag_groups.items():
+            if lag_region == region:
+                continue  # A region is never its own aux region, a global model was trained with NaN there
+            source = histories.get(lag_region) if lag_region else history
+            if source is not None:
+                row[positions] = source.gather(source.week_number(date) - lags, columns)
+
+        if self.rolling:
+            max_size = max(size for _, size, _ in self.rolling)
+            weeks = week - ROLLING_SOURCE_LAG - np.arange(max_size)
+            window = history.gather(weeks, STAGE_1_INDEX[ROLLING_SOURCE_COLUMN])
+            for position, size, stat in self.rolling:
+                # pandas rolling needs a full window, std is the sample std as in pandas
+                values = window[:size]
+                if not np.isnan(values).any():
+                    row[position] = stat(values, ddof=1) if stat is np.std else stat(values)
+
+        timestamp = pd.Timestamp(date)
+        time_values = {
+            'Year': timestamp.year,
+            'MonthSin': np.sin(2 * np.pi * timestamp.month / 12),
+            'MonthCos': np.cos(2 * np.pi * timestamp.month / 12),
+            'Day': timestamp.day,
+            'DayofWeekSin': np.sin(2 * np.pi * timestamp.dayofweek / 7),
+            'DayofWeekCos': np.cos(2 * np.pi * timestamp.dayofweek / 7),
+            'WeekofYearSin': np.sin(2 * np.pi * timestamp.isocalendar().week / 52),
+            'WeekofYearCos': np.cos(2 * np.pi * timestamp.isocalendar().week / 52),
+            'QuarterSin': np.sin(2 * np.pi * timestamp.quarter / 4),
+            'QuarterCos': np.cos(2 * np.pi * timestamp.quarter / 4),
+            'TimeIndex': int(week),
+        }
+        for position, name in self.time:
+            row[position] = time_values[name]
+        if self.region_code_position is not None:
+            row[self.region_code_position] = np.nan if region_code is None else region_code
+
+        rows = np.tile(row, (len(type_names), 1))
+        for position, type_name in self.types:
+            rows[:, position] = [type_name == requested for requested in type_names]
+        return rows
+
+
+class HistoryStore:
+    """
+    In-memory, incrementally updated histories of every region, shared by the API worker threads.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.capacity = capacity
+        self.histories: Dict[str, RegionHistory] = {}
+        self.lock = threading.Lock()
+
+    def add_observations(self, observations: List[RawObservation], default_region: str = None):
+        """ Add observations to the histories, all or none: they are all checked before any history changes.
+        A region seen for the first time starts at its oldest observation.
+
+        Raises:
+            ValueError: If an observation is older than the origin of its region's history.
+        """
+        with self.lock:
+            observations = sorted(observations, key=lambda observation: observation.Date)
+            regions = [observation.region or default_region for observation in observations]
+            for region, observation in zip(regions, observations):
+                history = self.histories.get(region)
+                if history is not None and history.week_number(observation.Date) < 0:
+                    raise ValueError(
+                        f"Observation of '{region}' on {observation.Date} is older than its history origin "
+                        f"{history.origin}")
+            for region, observation in zip(regions, observations):
+                if region not in self.histories:
+                    self.histories[region] = RegionHistory(observation.Date, self.capacity)
+                self.histories[region].add(observation.Date, observation.type, observation.raw_values())
+
+    def load_csv(self, path: str):
+        """ Seed the histories from a file in the avocado.csv schema, keeping each region's first date as origin """
+        raw_df = pd.read_csv(path)
+        raw_df['Date'] = pd.to_datetime(raw_df['Date']).dt.date
+        records = raw_df.drop(columns=['Unnamed: 0', 'year'], errors='ignore').to_dict(orient='records')
+        self.add_observations([RawObservation(**record) for record in records])
@@ -0,0 +1,20 @@
+"""
+gunicorn settings of the multi-worker API, run from the repo root: gunicorn -c src/gunicorn_conf.py src.api:app
+
+The master imports the app and loads the model table before forking API_WORKERS uvicorn workers, which share
+the loaded models copy-on-write. Adding a worker then costs the memory it writes to, not another copy of every
+model, and only the master reads the registry and downloads models at startup.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('API_PORT', '8000')}"
+workers = int(os.getenv("API_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app in the master, so on_starting can load the models the workers are forked with
+preload_app = True
+
+
+def on_starting(server):
+    from src import api
+
+    api.preload_models()
@@ -0,0 +1,135 @@
+"""
+Prometheus metrics of the API, served in the text exposition format by GET /metrics.
+
+Request counts and latencies are recorded by an ASGI middleware, per route and region. Stage latencies
+(validation, model input build, predict) and batch sizes are recorded where the work happens. Label
+children are cached, so an observation costs a dict lookup and a histogram update. Setting METRICS_ENABLED=false
+turns every observation into a no-op, which the overhead benchmark uses as its baseline.
+"""
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Regions the API does not serve are counted under one label, so clients cannot create new series
+UNKNOWN_REGION = 'unknown'
+
+registry = CollectorRegistry()
+requests_total = Counter(
+    'avocado_requests', 'HTTP requests by route, region and status code',
+    ['route', 'region', 'status'], registry=registry)
+request_seconds = Histogram(
+    'avocado_request_seconds', 'HTTP request latency by route and region',
+    ['route', 'region'], buckets=LATENCY_BUCKETS, registry=registry)
+stage_seconds = Histogram(
+    'avocado_stage_seconds', 'Latency of the request stages: validation, build_input and predict',
+    ['region', 'stage'], buckets=LATENCY_BUCKETS, registry=registry)
+request_records = Histogram(
+    'avocado_request_records', 'Records per prediction request',
+    ['route'], buckets=SIZE_BUCKETS, registry=registry)
+predict_rows = Histogram(
+    'avocado_predict_rows', 'Rows per model call, batch requests stack the regions of a model',
+    buckets=SIZE_BUCKETS, registry=registry)
+model_load_seconds = Gauge(
+    'avocado_model_load_seconds', 'Seconds the last load of a registered model took', ['model'], registry=registry)
+models_loaded = Gauge('avocado_models_loaded', 'Distinct models loaded in memory', registry=registry)
+models_registered = Gauge('avocado_models_registered', 'Regions in the model table', registry=registry)
+model_bytes = Gauge(
+    'avocado_model_bytes', 'Approximate memory of the loaded models: size of their model files', registry=registry)
+
+enabled = os.getenv('METRICS_ENABLED', 'true').lower() != 'false'
+children = {}
+
+
+def child(metric, *labels):
+    key = (metric, labels)
+    if key not in children:
+        children[key] = metric.labels(*labels)
+    return children[key]
+
+
+def observe_stage(region, stage, seconds):
+    if enabled:
+        child(stage_seconds, region, stage).observe(seconds)
+
+
+def observe_records(route, n_records):
+    if enabled:
+        child(request_records, route).observe(n_records)
+
+
+def observe_predict_rows(n_rows):
+    if enabled:
+        predict_rows.observe(n_rows)
+
+
+class PredictionCacheCollector:
+    """
+    Reads the prediction cache counters at scrape time, so the cache itself only increments integers.
+
+    Args:
+        stats (callable): Returns the cache stats: entries, hits, misses, evictions and expirations.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def collect(self):
+        stats = self.stats()
+        if stats is None:
+            return
+        yield GaugeMetricFamily('avocado_prediction_cache_entries', 'Predictions in the cache', value=stats['entries'])
+        for event, description in [
+                ('hits', 'Requests answered from the prediction cache'),
+                ('misses', 'Requests the prediction cache did not hold, expired entries included'),
+                ('evictions', 'Least recently used predictions dropped to keep the cache in its size'),
+                ('expirations', 'Cached predictions found older than the TTL')]:
+            yield CounterMetricFamily(f'avocado_prediction_cache_{event}', description, value=stats[event])
+
+
+def register_prediction_cache(stats):
+    registry.register(PredictionCacheCollector(stats))
+
+
+def render():
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware counting requests and timing them by route template and region.
+
+    Args:
+        app: The wrapped ASGI app.
+        known_regions (callable): Returns the regions with a model, other regions are labelled 'unknown'.
+    """
+
+    def __init__(self, app, known_regions):
+        self.app = app
+        self.known_regions = known_regions
+
+    async def __call__(self, scope, receive, send):
+        if not enabled or scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        status = ['500']
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get('route')
+            route_path = route.path if route is not None else 'unmatched'
+            region = scope.get('path_params', {}).get('region', '')
+            if region and region not in self.known_regions():
+                region = UNKNOWN_REGION
+            child(requests_total, route_path, region, status[0]).inc()
+            child(request_seconds, route_path, region).observe(time.perf_counter() - start)
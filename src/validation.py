@@ -0,0 +1,120 @@
+"""
+Column-wise validation of prediction records, compiled once per model when it loads.
+
+Validating each record with the pydantic schema costs a model instantiation and a dict dump per record. A
+BatchValidator instead reads all records in signature order with one itemgetter, checks the value types of
+the whole batch at once and converts it to a NumPy array in a single call. Integer and boolean columns are then
+checked on the array: integer columns must hold whole, finite numbers and boolean columns 0 or 1, which is what
+pydantic accepts from numbers.
+
+Anything outside this fast path (a missing column, a string, a None, a record that is not an object) is handed
+to the pydantic schema record by record. Valid data the schema coerces (numeric strings, "true") still passes,
+and invalid data fails with the same error message as before.
+"""
+from itertools import chain
+from operator import itemgetter
+from typing import List
+
+import numpy as np
+
+# MLflow column types of the signature, by the dtype the pyfunc model input gets
+COLUMN_KINDS = {
+    'double': 'float',
+    'float': 'float',
+    'integer': 'int',
+    'long': 'int',
+    'boolean': 'bool',
+}
+FRAME_DTYPES = {'float': np.float64, 'int': np.int32, 'bool': np.bool_}
+# JSON numbers and booleans, the types converted without the schema
+NUMERIC_TYPES = {int, float, bool}
+
+
+class BatchValidator:
+    """
+    Validates a list of records of one model into its input array, see the module docstring.
+
+    Args:
+        input_schema (list): The signature inputs, as returned by `signature.inputs.to_dict()`.
+        schema (pydantic.BaseModel): The record schema built by api.make_input_schema, used for what the
+            fast path does not accept.
+        exclude (tuple): Input columns the client does not send, left as NaN for the caller to fill.
+        dtype: The dtype of the validated array.
+
+    Raises:
+        ValueError: If an input column is not numeric or boolean.
+    """
+
+    def __init__(self, input_schema: List[dict], schema, exclude=(), dtype=np.float64):
+        self.feature_names = [col['name'] for col in input_schema]
+        self.kinds = []
+        for col in input_schema:
+            mlflow_type = col.get('type', 'string').lower()
+            if mlflow_type not in COLUMN_KINDS:
+                raise ValueError(
+                    f"Input column '{col['name']}' has type '{mlflow_type}', only numbers and booleans are supported")
+            self.kinds.append(COLUMN_KINDS[mlflow_type])
+        self.frame_dtypes = {name: FRAME_DTYPES[kind] for name, kind in zip(self.feature_names, self.kinds)}
+        self.schema = schema
+        self.dtype = dtype
+
+        self.columns = [name for name in self.feature_names if name not in exclude]
+        self.positions = np.array([self.feature_names.index(name) for name in self.columns], dtype=np.intp)
+        self.full_width = len(self.columns) == len(self.feature_names)
+        # itemgetter returns a bare value rather than a tuple for a single column
+        getter = itemgetter(*self.columns)
+        self.get_row = getter if len(self.columns) > 1 else lambda record: (getter(record),)
+        # Integer and boolean columns, by their position among the client columns
+        self.int_columns = np.array(
+            [i for i, name in enumerate(self.columns) if self.frame_dtypes[name] is np.int32], dtype=np.intp)
+        self.bool_columns = np.array(
+            [i for i, name in enumerate(self.columns) if self.frame_dtypes[name] is np.bool_], dtype=np.intp)
+
+    def validate(self, records: List[dict]):
+        """
+        Validate records into an array with one row per record, in the signature column order.
+
+        Args:
+            records (List[dict]): The records posted by the client.
+
+        Returns:
+            np.ndarray: The validated input, NaN in the excluded columns.
+
+        Raises:
+            ValueError, TypeError: From the schema, for the first invalid record.
+        """
+        values = self.convert(records)
+        if values is None:
+            values = self.convert_with_schema(records)
+        if self.full_width:
+            return values.astype(self.dtype, copy=False)
+        model_input = np.full((len(records), len(self.feature_names)), np.nan, dtype=self.dtype)
+        model_input[:, self.positions] = values
+        return model_input
+
+    def convert(self, records: List[dict]):
+        """ The fast path: the float64 array of the client columns, None if the batch needs the schema """
+        try:
+            rows = list(map(self.get_row, records))
+        except (KeyError, TypeError, IndexError):
+            return None
+        if not set(map(type, chain.from_iterable(rows))) <= NUMERIC_TYPES:
+            return None
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), len(self.columns))
+        # count_nonzero rather than all(), whose overhead dominates on a few rows. An infinite or NaN value
+        # leaves a NaN in both checks, which counts as nonzero
+        with np.errstate(invalid='ignore'):
+            if len(self.int_columns):
+                int_values = values.take(self.int_columns, axis=1)
+                if np.count_nonzero(int_values - np.trunc(int_values)):
+                    return None
+            if len(self.bool_columns):
+                bool_values = values.take(self.bool_columns, axis=1)
+                if np.count_nonzero(bool_values * (bool_values - 1)):
+                    return None
+        return values
+
+    def convert_with_schema(self, records: List[dict]):
+        """ The pydantic path, raising the schema error of the first invalid record """
+        validated = [self.schema(**record).model_dump() for record in records]
+        return np.array(list(map(self.get_row, validated)), dtype=np.float64).reshape(len(validated), len(self.columns))